@@ -0,0 +1,280 @@
+"""Annotate a VCF with CIViC molecular profiles without a full `oc run`.
+
+Records are streamed from a plain, gzipped or bgzipped VCF and cut into chunks
+that never span a chromosome. A process pool annotates the chunks and the
+results are written back in input order, so memory stays bounded by the
+number of chunks in flight. Each chunk is looked up with one range query over
+its chromosome and positions instead of one query per record.
+
+Alleles are normalized the way OpenCRAVAT's converter does before lookup:
+shared trailing and then leading bases are trimmed, the position moves past
+the leading bases, and an empty allele becomes '-'. The lookup follows
+civic_molecular_profile: the best scored single-variant profile at the key is
+written as MP, VID, MPS, NAE and NSE, as in civic_molecular_profile/test/test.vcf.
+Every field has one value per ALT allele, '.' for alleles without a match, and
+VID separates the variant ids of one allele's profile with '|'.
+Components of AND profiles are collected across the whole file, and the
+profiles whose components were all seen are written to --compound.
+With --civic-db the civic annotator's variant id is added as CIVIC, matched on
+the coordinates of --assembly the way the civic annotator's assembly option
+picks them. It defaults to hg19, the assembly of variants.db.
+"""
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+CHUNK_SIZE = 5000
+INFO_HEADERS = [
+    '##INFO=<ID=MP,Number=A,Type=Integer,Description="Molecular Profile ID">',
+    '##INFO=<ID=VID,Number=A,Type=String,Description="Variant IDs, separated by |">',
+    '##INFO=<ID=MPS,Number=A,Type=Float,Description="Molecular Profile Score">',
+    '##INFO=<ID=NAE,Number=A,Type=Integer,Description="Number of Accepted EIDs">',
+    '##INFO=<ID=NSE,Number=A,Type=Integer,Description="Number of Submitted EIDs">',
+]
+PROFILE_INFO_IDS = ['MP', 'VID', 'MPS', 'NAE', 'NSE']
+CIVIC_INFO_HEADER = '##INFO=<ID=CIVIC,Number=A,Type=Integer,Description="CIViC Variant ID">'
+INFO_IDS = set(PROFILE_INFO_IDS) | {'CIVIC'}
+ASSEMBLIES = {'hg38': 'hg38', 'grch38': 'hg38', 'hg19': 'hg19', 'grch37': 'hg19'}
+# civic.sqlite stores the GRCh38 start as text, so it is cast to compare with record positions
+COORDINATE_COLUMNS = {
+    'hg38': ('chromosome', 'start', 'CAST(start AS INTEGER)'),
+    'hg19': ('chromosome_grch37', 'start_grch37', 'start_grch37'),
+}
+
+# Per-process database connections, opened by init_worker
+_worker = {}
+
+
+def open_vcf(path):
+    """Open a VCF for reading as text. bgzip output is multi-member gzip, which the gzip module reads."""
+    if path == '-':
+        return sys.stdin
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt')
+    return open(path)
+
+
+def normalize(pos, ref, alt):
+    """Trim shared bases the way OpenCRAVAT's converter does, returning (pos, ref, alt)"""
+    while ref and alt and ref[-1] == alt[-1]:
+        ref, alt = ref[:-1], alt[:-1]
+    while ref and alt and ref[0] == alt[0]:
+        ref, alt = ref[1:], alt[1:]
+        pos += 1
+    return pos, ref or '-', alt or '-'
+
+
+def profile_columns(db):
+    """variant_id and is_and, read as NULL from databases built before AND profiles were evaluated"""
+    columns = {row[1] for row in db.execute('PRAGMA table_info(variants)')}
+    return ', '.join(name if name in columns else 'NULL' for name in ('variant_id', 'is_and'))
+
+
+def init_worker(variants_db, civic_db, assembly):
+    _worker['variants'] = sqlite3.connect(variants_db)
+    _worker['profile_columns'] = profile_columns(_worker['variants'])
+    _worker['civic'] = sqlite3.connect(civic_db) if civic_db else None
+    _worker['civic_columns'] = COORDINATE_COLUMNS[assembly]
+
+
+def lookup_chunk(chrom, lines):
+    """Annotate the lines of one chunk, all on chrom. Returns the output lines and the AND profile components seen."""
+    records = []
+    for line in lines:
+        # Hand-written VCFs such as the module test input separate columns with spaces
+        fields = line.rstrip('\n').split('\t') if '\t' in line else line.split()
+        keys = []
+        for alt in fields[4].split(','):
+            # Symbolic, breakend and spanning-deletion alleles cannot match a CIViC coordinate
+            if alt in ('.', '*') or alt.startswith('<') or '[' in alt or ']' in alt:
+                keys.append(None)
+            else:
+                keys.append(normalize(int(fields[1]), fields[3].upper(), alt.upper()))
+        records.append((fields, keys))
+    positions = [key[0] for _, keys in records for key in keys if key is not None]
+    if not positions:
+        return ['\t'.join(fields) + '\n' for fields, _ in records], []
+    lookup_chrom = chrom.replace('chr', '')
+    low, high = min(positions), max(positions)
+
+    profiles = defaultdict(list)
+    query = f'''
+    SELECT start, ref, alt, mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids, {_worker['profile_columns']}
+    FROM variants
+    WHERE chrom = ? AND start BETWEEN ? AND ?
+    ORDER BY molecular_profile_score IS NULL, molecular_profile_score DESC
+    '''
+    for row in _worker['variants'].execute(query, (lookup_chrom, low, high)):
+        profiles[row[:3]].append(row[3:])
+    civic_ids = {}
+    if _worker['civic'] is not None:
+        chromosome, _, start = _worker['civic_columns']
+        query = f'''
+        SELECT {start}, reference_base, variant_base, id
+        FROM civic
+        WHERE {chromosome} = ? AND {start} BETWEEN ? AND ?
+        '''
+        for start, ref, alt, civic_id in _worker['civic'].execute(query, ('chr' + lookup_chrom, low, high)):
+            civic_ids.setdefault((start, ref, alt), civic_id)
+
+    out = []
+    compound = []
+    for fields, keys in records:
+        # One column of values per ALT allele, so a match on a later allele is not lost behind the first
+        matches = []
+        for key in keys:
+            match = None
+            for mp_id, variant_ids, score, num_acc_eids, num_sub_eids, variant_id, is_and in profiles.get(key, ()):
+                if is_and:
+                    compound.append((mp_id, variant_id, '%s:%s:%s:%s' % ((chrom,) + key)))
+                elif match is None:
+                    vids = '|'.join(str(vid) for vid in json.loads(variant_ids))
+                    match = (mp_id, vids, score, num_acc_eids, num_sub_eids)
+            matches.append(match)
+        info = []
+        if any(matches):
+            for n, name in enumerate(PROFILE_INFO_IDS):
+                info.append(name + '=' + ','.join('.' if match is None else str(match[n]) for match in matches))
+        civic_matches = [civic_ids.get(key) for key in keys]
+        if any(civic_id is not None for civic_id in civic_matches):
+            info.append('CIVIC=' + ','.join('.' if civic_id is None else str(civic_id) for civic_id in civic_matches))
+        if len(fields) < 8:
+            fields += ['.'] * (8 - len(fields))
+        # Values from an earlier annotation pass are replaced, like their header lines
+        kept = [item for item in fields[7].split(';') if item not in ('', '.') and item.split('=', 1)[0] not in INFO_IDS]
+        fields[7] = ';'.join(kept + info) or '.'
+        out.append('\t'.join(fields) + '\n')
+    return out, compound
+
+
+def iter_chunks(vcf, chunk_size):
+    """Yield (chrom, lines) for consecutive records, cutting at every chromosome change"""
+    chrom = None
+    lines = []
+    for line in vcf:
+        record_chrom = line.split(None, 1)[0]
+        if lines and (record_chrom != chrom or len(lines) >= chunk_size):
+            yield chrom, lines
+            lines = []
+        chrom = record_chrom
+        lines.append(line)
+    if lines:
+        yield chrom, lines
+
+
+def load_compound_masks(variants_db):
+    """Bitmask of each AND profile's components, as civic_molecular_profile builds in setup"""
+    bits = defaultdict(dict)
+    masks = {}
+    rows = {}
+    with sqlite3.connect(variants_db) as db:
+        if 'NULL' in profile_columns(db):
+            return bits, masks, rows
+        for mp_id, variant_id, position in db.execute('''
+        SELECT mp_id, variant_id, position FROM profile_variants
+        WHERE mp_id IN (SELECT mp_id FROM variants WHERE is_and = 1)
+        '''):
+            bits[variant_id][mp_id] = bits[variant_id].get(mp_id, 0) | 1 << position
+            masks[mp_id] = masks.get(mp_id, 0) | 1 << position
+        for mp_id, variant_ids, score, num_acc_eids, num_sub_eids in db.execute('''
+        SELECT mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids FROM variants WHERE is_and = 1
+        '''):
+            rows[mp_id] = (variant_ids, score, num_acc_eids, num_sub_eids)
+    return bits, masks, rows
+
+
+def check_civic_db(civic_db, assembly='hg19'):
+    """Raise ValueError unless civic_db has the assembly's keys VCF records are matched on"""
+    _, column, _ = COORDINATE_COLUMNS[assembly]
+    with sqlite3.connect(f'file:{civic_db}?mode=ro', uri=True) as db:
+        if column not in {row[1] for row in db.execute('PRAGMA table_info(civic)')}:
+            raise ValueError(f'{civic_db} predates {assembly} keys; rebuild civic.sqlite with previous-builders/civic/build_civic.py')
+
+
+def annotate(vcf, out, variants_db, civic_db=None, workers=None, chunk_size=CHUNK_SIZE, assembly='hg19'):
+    """Write the annotated VCF to out and return the satisfied AND profiles as {mp_id: (row, record keys)}"""
+    if civic_db:
+        check_civic_db(civic_db, assembly)
+    for line in vcf:
+        if line.startswith('#CHROM'):
+            out.writelines(header + '\n' for header in INFO_HEADERS)
+            if civic_db:
+                out.write(CIVIC_INFO_HEADER + '\n')
+            out.write(line)
+            break
+        # Existing definitions of our fields are replaced by the ones above
+        if not any(line.startswith(header.split(',', 1)[0] + ',') for header in INFO_HEADERS + [CIVIC_INFO_HEADER]):
+            out.write(line)
+
+    bits, masks, rows = load_compound_masks(variants_db)
+    hits = defaultdict(int)
+    seen = defaultdict(list)
+
+    def write(future):
+        lines, compound = future.result()
+        out.writelines(lines)
+        for mp_id, variant_id, key in compound:
+            hits[mp_id] |= bits[variant_id].get(mp_id, 0)
+            seen[mp_id].append(key)
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(variants_db, civic_db, assembly)) as pool:
+        # Keep a bounded window of chunks in flight and write them back in input order
+        window = deque()
+        for chrom, lines in iter_chunks(vcf, chunk_size):
+            window.append(pool.submit(lookup_chunk, chrom, lines))
+            while len(window) >= 4 * workers or (window and window[0].done()):
+                write(window.popleft())
+        while window:
+            write(window.popleft())
+    return {mp_id: (rows[mp_id], sorted(set(seen[mp_id]))) for mp_id, hit in hits.items() if hit == masks.get(mp_id)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Annotate a VCF with CIViC molecular profiles')
+    parser.add_argument('input', help='VCF, gzipped VCF or bgzipped VCF; - for stdin')
+    parser.add_argument('--output', default='-', help='Output VCF, gzipped when it ends in .gz (default: stdout)')
+    parser.add_argument('--variants-db', default='variants.db', help='create_sqlite3.py output')
+    parser.add_argument('--civic-db', help='civic annotator database, to add the CIViC variant id')
+    parser.add_argument('--assembly', type=str.lower, choices=ASSEMBLIES, default='hg19',
+                        help='Assembly of the input, which picks the civic coordinates --civic-db is matched on (default: hg19)')
+    parser.add_argument('--compound', help='Write the AND profiles whose components were all seen to this TSV')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Records per chunk of work')
+    args = parser.parse_args()
+    args.assembly = ASSEMBLIES[args.assembly]
+    if args.civic_db:
+        # Before the output is opened, so a stale database does not leave an empty VCF behind
+        try:
+            check_civic_db(args.civic_db, args.assembly)
+        except (ValueError, sqlite3.Error) as e:
+            parser.error(str(e))
+
+    vcf = open_vcf(args.input)
+    if args.output == '-':
+        out = sys.stdout
+    elif args.output.endswith('.gz'):
+        out = gzip.open(args.output, 'wt')
+    else:
+        out = open(args.output, 'w')
+    try:
+        satisfied = annotate(vcf, out, args.variants_db, args.civic_db, args.workers, args.chunk_size, args.assembly)
+    finally:
+        vcf.close()
+        if out is not sys.stdout:
+            out.close()
+
+    if args.compound:
+        with open(args.compound, 'w') as f:
+            print('mp_id', 'variant_ids', 'molecular_profile_score', 'num_acc_eids', 'num_sub_eids', 'records', sep='\t', file=f)
+            for mp_id, ((variant_ids, score, num_acc_eids, num_sub_eids), keys) in sorted(satisfied.items()):
+                variant_ids = ','.join(str(variant_id) for variant_id in json.loads(variant_ids))
+                print(mp_id, variant_ids, score, num_acc_eids, num_sub_eids, ','.join(keys), sep='\t', file=f)
+    print(f'{len(satisfied)} AND profiles satisfied', file=sys.stderr)
@@ -0,0 +1,257 @@
+"""Write scaled-up copies of the annotator databases for index scaling tests.
+
+civic.sqlite and civic_gene.sqlite are written through the builders' own
+CivicDB classes, so they have the current schema, indexes, GRCh37 keys, score
+percentiles, evidence tables and summaries, per-disease scores and full-text
+search tables, whatever the shipped files predate. variants.db is written by
+create_sqlite3.py, with evidence items behind its summary columns. Rows are
+copied from randomly chosen real rows with new keys, so text columns keep
+their real size. New positions cluster around real CIViC positions, a share
+of them are hotspots with many alleles, and a share of the molecular profiles
+combine several variants. GRCh37 keys are the new GRCh38 ones moved by one
+offset per chromosome, as a liftover roughly does, and evidence items are
+drawn at random.
+"""
+import argparse
+import importlib.util
+import itertools
+import os
+import random
+import sqlite3
+import sys
+
+from generate_workload import CIVIC_DB, CIVIC_GENE_DB, MOLECULAR_PROFILE_DB, ROOT
+
+sys.path.insert(0, ROOT)
+from create_sqlite3 import EVIDENCE_LEVELS, EVIDENCE_TYPE_COLUMNS, VariantsDB  # noqa: E402
+
+BASES = 'ACGT'
+BATCH_SIZE = 10000
+# Standard deviation of the distance between a new position and the real one it is placed near
+POSITION_SPREAD = 20000
+# Largest distance between a chromosome's GRCh38 and GRCh37 positions
+GRCH37_SHIFT = 1000000
+EVIDENCE_STATUSES = ['accepted', 'submitted', 'rejected']
+EVIDENCE_STATUS_WEIGHTS = [6, 3, 1]
+# Most curated evidence is at the case study and clinical trial levels
+EVIDENCE_LEVEL_WEIGHTS = [1, 4, 8, 6, 2]
+EVIDENCE_DIRECTIONS = ['SUPPORTS', 'DOES_NOT_SUPPORT']
+EVIDENCE_SIGNIFICANCES = ['SENSITIVITYRESPONSE', 'RESISTANCE', 'POOR_OUTCOME', 'BETTER_OUTCOME', 'PATHOGENIC']
+
+
+def load_builder_db(directory, module_name):
+    """A builder's CivicDB class, loaded from its file so the two builders' classes do not shadow each other"""
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, 'previous-builders', directory, module_name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CivicDB
+
+
+CivicVariantDB = load_builder_db('civic', 'civic_db')
+CivicGeneDB = load_builder_db('civic_gene', 'civic_gene_db')
+
+
+def read_table(path, table):
+    with sqlite3.connect(path) as db:
+        cursor = db.execute(f'SELECT * FROM {table}')
+        columns = [column[0] for column in cursor.description]
+        return columns, cursor.fetchall()
+
+
+def fast_writes(db):
+    # The output is rewritten from scratch on every run, so there is nothing to protect
+    db.cursor.execute('PRAGMA journal_mode = MEMORY')
+    db.cursor.execute('PRAGMA synchronous = OFF')
+
+
+def write_batches(rows, insert):
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return
+        insert(batch)
+
+
+def iter_alleles(rng, ref, count):
+    """The three substitutions first, then insertions and a deletion, as at real hotspots"""
+    alts = [base for base in BASES if base != ref]
+    yield from alts[:count]
+    if count > len(alts):
+        yield '-'
+    for _ in range(count - len(alts) - 1):
+        yield ref + ''.join(rng.choice(BASES) for _ in range(rng.randint(1, 6)))
+
+
+def iter_keys(rng, anchors, hotspot_share, max_alleles):
+    """Yield unique (chrom, pos, ref, alt) keys forever, placed near the anchor positions"""
+    seen = set()
+    while True:
+        chrom, anchor = anchors[rng.randrange(len(anchors))]
+        pos = max(1, anchor + int(rng.gauss(0, POSITION_SPREAD)))
+        ref = rng.choice(BASES)
+        count = 1
+        if rng.random() < hotspot_share:
+            # Pareto-distributed allele counts: most hotspots have a few alleles, some have many
+            count = min(max_alleles, 1 + int(rng.paretovariate(1.2)))
+        for alt in iter_alleles(rng, ref, count):
+            key = (chrom, pos, ref, alt)
+            if key not in seen:
+                seen.add(key)
+                yield key
+
+
+def load_anchors():
+    anchors = set()
+    with sqlite3.connect(MOLECULAR_PROFILE_DB) as db:
+        anchors.update((str(chrom), int(start)) for chrom, start in db.execute('SELECT chrom, start FROM variants'))
+    with sqlite3.connect(CIVIC_DB) as db:
+        for chrom, start in db.execute('SELECT chromosome, start FROM civic'):
+            if chrom and start:
+                anchors.add((chrom.replace('chr', ''), int(start)))
+    return sorted(anchors)
+
+
+def iter_evidence(rng, ids, variant_id, diseases):
+    """civic_evidence rows for one variant: most variants have a few items, some have many"""
+    for _ in range(int(rng.paretovariate(1.2)) - 1 + rng.randint(0, 2)):
+        yield (
+            next(ids),
+            variant_id,
+            rng.choices(EVIDENCE_STATUSES, EVIDENCE_STATUS_WEIGHTS)[0],
+            rng.choices(EVIDENCE_LEVELS, EVIDENCE_LEVEL_WEIGHTS)[0],
+            rng.choice(list(CivicVariantDB.evidence_type_columns)),
+            rng.choice(EVIDENCE_DIRECTIONS),
+            rng.choice(EVIDENCE_SIGNIFICANCES),
+            rng.choice(diseases) if diseases else None,
+            None,
+        )
+
+
+def write_civic(path, rng, keys, scale):
+    columns, templates = read_table(CIVIC_DB, 'civic')
+    with sqlite3.connect(CIVIC_GENE_DB) as db:
+        genes = [name for name, in db.execute('SELECT name FROM civic_gene')]
+    grch37_offsets = {}
+    ids = itertools.count(1)
+
+    def rows():
+        for n in range(len(templates) * scale):
+            row = dict(zip(columns, rng.choice(templates)))
+            chrom, pos, ref, alt = next(keys)
+            offset = grch37_offsets.setdefault(chrom, rng.randint(-GRCH37_SHIFT, GRCH37_SHIFT))
+            diseases = [disease for disease in (row['diseases'] or '').split(', ') if disease]
+            variant = (n + 1, 'chr' + chrom, str(pos), row.get('reference_build') or 'GRCh37', ref, alt, row['description'],
+                       row['molecular_profile_score'], row['diseases'], 'chr' + chrom, max(1, pos + offset), rng.choice(genes))
+            yield variant, list(iter_evidence(rng, ids, n + 1, diseases))
+
+    def insert(batch):
+        db.insert_variants([variant for variant, _ in batch])
+        db.insert_evidence([evidence for _, items in batch for evidence in items])
+
+    # The builder's order: load, then rank, summarize and index once
+    with CivicVariantDB(path) as db:
+        fast_writes(db)
+        db.create_variant_table()
+        write_batches(rows(), insert)
+        db.rank_scores()
+        db.aggregate_evidence()
+        db.create_index()
+        db.create_search_index()
+    return len(templates) * scale
+
+
+def write_civic_gene(path, rng, scale):
+    columns, templates = read_table(CIVIC_GENE_DB, 'civic_gene')
+    with CivicGeneDB(path) as db:
+        fast_writes(db)
+        db.create_variant_table()
+        rows = []
+        for copy in range(scale):
+            # The first copy keeps the real names, so real gene symbols still hit
+            suffix = f'-S{copy}' if copy else ''
+            for template in templates:
+                row = dict(zip(columns, template))
+                aliases = [alias + suffix for alias in (row['aliases'] or '').split(',') if alias]
+                row.update(id=len(rows) + 1, name=row['name'] + suffix, aliases=','.join(aliases))
+                rows.append((row['id'], row['name'], row['description'], row['aliases']))
+        rng.shuffle(rows)
+        db.insert_genes(rows)
+        db.create_index()
+        db.create_search_index()
+    return len(rows)
+
+
+def profile_evidence(rng, ids, num_acc_eids, num_sub_eids):
+    """Evidence items matching a profile's counts, and the aggregates get-civicpy-data.py writes for them"""
+    items = [
+        {'id': next(ids), 'status': status, 'level': rng.choices(EVIDENCE_LEVELS, EVIDENCE_LEVEL_WEIGHTS)[0],
+         'type': rng.choice(list(EVIDENCE_TYPE_COLUMNS)), 'disease': None, 'therapies': None}
+        for status, count in (('accepted', num_acc_eids or 0), ('submitted', num_sub_eids or 0))
+        for _ in range(count)
+    ]
+    return {
+        'evidence_levels': {level: sum(item['level'] == level for item in items) for level in EVIDENCE_LEVELS},
+        'evidence_types': {ev_type: sum(item['type'] == ev_type for item in items) for ev_type in EVIDENCE_TYPE_COLUMNS},
+        'evidence_items': items,
+    }
+
+
+def iter_profile_records(rng, keys, scale, and_share):
+    """Single-variant profiles for every new variant, plus AND profiles over up to four of them"""
+    columns, templates = read_table(MOLECULAR_PROFILE_DB, 'variants')
+    variants = []
+    ids = itertools.count(1)
+    profiles = len(templates) * scale
+    for mp_id in range(1, profiles + 1):
+        template = dict(zip(columns, rng.choice(templates)))
+        counts = {
+            'molecular_profile_score': template['molecular_profile_score'],
+            'num_acc_eids': template['num_acc_eids'],
+            'num_sub_eids': template['num_sub_eids'],
+        }
+        evidence = profile_evidence(rng, ids, template['num_acc_eids'], template['num_sub_eids'])
+        items = evidence.pop('evidence_items')
+        if len(variants) >= 4 and rng.random() < and_share:
+            components = rng.sample(variants, rng.randint(2, 4))
+            variant_ids = [variant_id for variant_id, _ in components]
+            for n, (variant_id, (chrom, pos, ref, alt)) in enumerate(components):
+                # As get-civicpy-data.py does, only a profile's first row carries its items
+                yield dict(chrom=chrom, start=pos, ref=ref, alt=alt, mp_id=mp_id, variant_ids=variant_ids,
+                           variant_id=variant_id, is_and=True, evidence_items=[] if n else items, **counts, **evidence)
+            continue
+        variant_id = len(variants) + 1
+        chrom, pos, ref, alt = next(keys)
+        variants.append((variant_id, (chrom, pos, ref, alt)))
+        yield dict(chrom=chrom, start=pos, ref=ref, alt=alt, mp_id=mp_id, variant_ids=[variant_id],
+                   variant_id=variant_id, is_and=False, evidence_items=items, **counts, **evidence)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write scaled-up civic.sqlite, civic_gene.sqlite and variants.db files')
+    parser.add_argument('--scale', type=int, default=10, help='Multiple of the shipped databases\' row counts')
+    parser.add_argument('--output-dir', help='Directory to write to (default: benchmarks/kb-x<scale>)')
+    parser.add_argument('--hotspot-share', type=float, default=0.05, help='Share of new positions with several alleles')
+    parser.add_argument('--max-alleles', type=int, default=16, help='Most alleles at one hotspot')
+    parser.add_argument('--and-share', type=float, default=0.1, help='Share of profiles that combine several variants')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), f'kb-x{args.scale}')
+    os.makedirs(output_dir, exist_ok=True)
+    for name in ('civic.sqlite', 'civic_gene.sqlite', 'variants.db'):
+        if os.path.exists(os.path.join(output_dir, name)):
+            os.remove(os.path.join(output_dir, name))
+
+    rng = random.Random(args.seed)
+    anchors = load_anchors()
+    keys = iter_keys(random.Random(args.seed), anchors, args.hotspot_share, args.max_alleles)
+    total = write_civic(os.path.join(output_dir, 'civic.sqlite'), rng, keys, args.scale)
+    print(f'civic.sqlite: {total} variants', file=sys.stderr)
+    total = write_civic_gene(os.path.join(output_dir, 'civic_gene.sqlite'), rng, args.scale)
+    print(f'civic_gene.sqlite: {total} genes', file=sys.stderr)
+    # The same key stream again, so variants.db shares its coordinates with civic.sqlite as the real files do
+    keys = iter_keys(random.Random(args.seed), anchors, args.hotspot_share, args.max_alleles)
+    with VariantsDB(os.path.join(output_dir, 'variants.db'), BATCH_SIZE) as db:
+        total = db.insert_records(iter_profile_records(rng, keys, args.scale, args.and_share))
+    print(f'variants.db: {total} rows', file=sys.stderr)
@@ -0,0 +1,163 @@
+"""Write synthetic crv/crg-style annotator inputs.
+
+Variant-level files have the columns uid, chrom, pos, ref_base and alt_base;
+gene-level files have uid, hugo, num_variants, so and all_so. The first line
+is '#' followed by the tab-separated column names. Hits are drawn from the
+annotator databases so the CIViC hit rate can be controlled; misses are random
+positions or gene symbols that are not in the knowledgebase.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+from collections import deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CIVIC_DB = os.path.join(ROOT, 'new-annotators', 'civic', 'data', 'civic.sqlite')
+CIVIC_GENE_DB = os.path.join(ROOT, 'new-annotators', 'civic_gene', 'data', 'civic_gene.sqlite')
+MOLECULAR_PROFILE_DB = os.path.join(ROOT, 'civic_molecular_profile', 'data', 'civic_molecular_profile.sqlite')
+
+VARIANT_COLUMNS = ['uid', 'chrom', 'pos', 'ref_base', 'alt_base']
+GENE_COLUMNS = ['uid', 'hugo', 'num_variants', 'so', 'all_so']
+
+# GRCh38 chromosome lengths, used to spread misses like a whole-genome callset
+CHROM_LENGTHS = {
+    '1': 248956422, '2': 242193529, '3': 198295559, '4': 190214555, '5': 181538259,
+    '6': 170805979, '7': 159345973, '8': 145138636, '9': 138394717, '10': 133797422,
+    '11': 135086622, '12': 133275309, '13': 114364328, '14': 107043718, '15': 101991189,
+    '16': 90338345, '17': 83257441, '18': 80373285, '19': 58617616, '20': 64444167,
+    '21': 46709983, '22': 50818468, 'X': 156040895, 'Y': 57227415,
+}
+BASES = 'ACGT'
+SO_TERMS = ['missense_variant', 'synonymous_variant', 'frameshift_elongation', 'stop_gained', 'splice_site_variant']
+
+# Repeated lines are drawn from this many of the most recent distinct lines
+DUPLICATE_WINDOW = 10000
+
+
+def knowledgebase_paths(kb_dir=None):
+    """The civic, civic_gene and molecular profile databases: the shipped ones, or generate_knowledgebase.py output"""
+    if kb_dir is None:
+        return CIVIC_DB, CIVIC_GENE_DB, MOLECULAR_PROFILE_DB
+    return tuple(os.path.join(kb_dir, name) for name in ('civic.sqlite', 'civic_gene.sqlite', 'variants.db'))
+
+
+def load_variant_keys(civic_db=CIVIC_DB, molecular_profile_db=MOLECULAR_PROFILE_DB, assembly='hg38'):
+    """Every (chrom, pos, ref, alt) the civic and civic_molecular_profile annotators can match, without 'chr'.
+
+    With assembly hg19 the civic keys are its GRCh37 ones, which only the civic annotator set to hg19 matches.
+    """
+    keys = set()
+    chromosome, start = ('chromosome_grch37', 'start_grch37') if assembly == 'hg19' else ('chromosome', 'start')
+    with sqlite3.connect(civic_db) as db:
+        for chrom, start, ref, alt in db.execute(f'SELECT {chromosome}, {start}, reference_base, variant_base FROM civic'):
+            if chrom and start and ref and alt:
+                keys.add((chrom.replace('chr', ''), int(start), ref, alt))
+    if assembly == 'hg19':
+        return sorted(keys)
+    with sqlite3.connect(molecular_profile_db) as db:
+        for chrom, start, ref, alt in db.execute('SELECT chrom, start, ref, alt FROM variants'):
+            keys.add((str(chrom), int(start), ref, alt))
+    return sorted(keys)
+
+
+def load_gene_names(civic_gene_db=CIVIC_GENE_DB):
+    """Gene names, and the aliases that are not themselves a gene name"""
+    with sqlite3.connect(civic_gene_db) as db:
+        rows = db.execute('SELECT name, aliases FROM civic_gene').fetchall()
+    names = [name for name, _ in rows if name]
+    aliases = sorted({alias for _, row_aliases in rows for alias in (row_aliases or '').split(',') if alias} - set(names))
+    return names, aliases
+
+
+def chrom_weights(distribution, keys):
+    chroms = list(CHROM_LENGTHS)
+    if distribution == 'genome':
+        return chroms, [CHROM_LENGTHS[chrom] for chrom in chroms]
+    if distribution == 'uniform':
+        return chroms, [1] * len(chroms)
+    # Follow the knowledgebase, so misses land near the hits the way a targeted panel does
+    counts = {chrom: 1 for chrom in chroms}
+    for chrom, _, _, _ in keys:
+        if chrom in counts:
+            counts[chrom] += 1
+    return chroms, [counts[chrom] for chrom in chroms]
+
+
+def iter_variant_lines(rng, lines, hit_rate, duplicate_rate, distribution, kb_dir=None, assembly='hg38'):
+    civic_db, _, molecular_profile_db = knowledgebase_paths(kb_dir)
+    keys = load_variant_keys(civic_db, molecular_profile_db, assembly)
+    known = set(keys)
+    chroms, weights = chrom_weights(distribution, keys)
+    cum_weights = list(itertools.accumulate(weights))
+    recent = deque(maxlen=DUPLICATE_WINDOW)
+    for uid in range(1, lines + 1):
+        if recent and rng.random() < duplicate_rate:
+            key = recent[rng.randrange(len(recent))]
+        elif rng.random() < hit_rate:
+            key = keys[rng.randrange(len(keys))]
+            recent.append(key)
+        else:
+            while True:
+                chrom = rng.choices(chroms, cum_weights=cum_weights)[0]
+                ref = rng.choice(BASES)
+                key = (chrom, rng.randrange(1, CHROM_LENGTHS[chrom]), ref, rng.choice(BASES.replace(ref, '')))
+                if key not in known:
+                    break
+            recent.append(key)
+        chrom, pos, ref, alt = key
+        yield (uid, 'chr' + chrom, pos, ref, alt)
+
+
+def iter_gene_lines(rng, lines, hit_rate, duplicate_rate, alias_share, kb_dir=None):
+    names, aliases = load_gene_names(knowledgebase_paths(kb_dir)[1])
+    recent = deque(maxlen=DUPLICATE_WINDOW)
+    for uid in range(1, lines + 1):
+        if recent and rng.random() < duplicate_rate:
+            hugo = recent[rng.randrange(len(recent))]
+        else:
+            if rng.random() >= hit_rate:
+                hugo = f'SYN{rng.randrange(10 ** 6):06d}'
+            elif aliases and rng.random() < alias_share:
+                hugo = rng.choice(aliases)
+            else:
+                hugo = rng.choice(names)
+            recent.append(hugo)
+        so = rng.choice(SO_TERMS)
+        yield (uid, hugo, rng.randint(1, 20), so, so)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic crv/crg-style input for the annotator benchmarks')
+    parser.add_argument('--level', choices=['variant', 'gene'], default='variant', help='Variant (crv) or gene (crg) lines')
+    parser.add_argument('--lines', type=int, default=10 ** 4, help='Number of input lines')
+    parser.add_argument('--hit-rate', type=float, default=0.01, help='Fraction of new lines drawn from the knowledgebase')
+    parser.add_argument('--duplicate-rate', type=float, default=0.0, help='Fraction of lines repeating a recent line')
+    parser.add_argument('--chrom-dist', choices=['genome', 'uniform', 'kb'], default='genome',
+                        help='Chromosome distribution of the misses: by length, uniform, or following the knowledgebase')
+    parser.add_argument('--alias-share', type=float, default=0.1, help='Share of gene hits that only match an alias')
+    parser.add_argument('--kb-dir', help='Draw hits from generate_knowledgebase.py output instead of the shipped databases')
+    parser.add_argument('--assembly', choices=['hg38', 'hg19'], default='hg38',
+                        help='Coordinates of the variant hits; hg19 draws them from civic.sqlite\'s GRCh37 keys')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, so a workload can be regenerated exactly')
+    parser.add_argument('--output', help='Output file (default: stdout)')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.level == 'variant':
+        columns = VARIANT_COLUMNS
+        rows = iter_variant_lines(rng, args.lines, args.hit_rate, args.duplicate_rate, args.chrom_dist, args.kb_dir,
+                                  args.assembly)
+    else:
+        columns = GENE_COLUMNS
+        rows = iter_gene_lines(rng, args.lines, args.hit_rate, args.duplicate_rate, args.alias_share, args.kb_dir)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        out.write('#' + '\t'.join(columns) + '\n')
+        out.writelines('\t'.join(map(str, row)) + '\n' for row in rows)
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,189 @@
+"""Drive the annotators' annotate method directly over a generated workload.
+
+Each annotator runs in a fresh process, so its peak RSS is its own. The
+annotator class is created without BaseAnnotator.__init__ (which expects a
+full `oc run` command line) and given the connection, cursor and output
+directory that OpenCRAVAT would set up, then setup, annotate for every line
+and cleanup are called as in a run. Only the annotate calls are timed.
+"""
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import random
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+# name -> (module, database, level)
+ANNOTATORS = {
+    'civic': ('new-annotators/civic/civic.py', 'new-annotators/civic/data/civic.sqlite', 'variant'),
+    'civic_gene': ('new-annotators/civic_gene/civic_gene.py', 'new-annotators/civic_gene/data/civic_gene.sqlite', 'gene'),
+    'civic_molecular_profile': ('civic_molecular_profile/civic_molecular_profile.py',
+                                'civic_molecular_profile/data/civic_molecular_profile.sqlite', 'variant'),
+}
+# File each annotator reads in a generate_knowledgebase.py directory
+KB_FILES = {'civic': 'civic.sqlite', 'civic_gene': 'civic_gene.sqlite', 'civic_molecular_profile': 'variants.db'}
+INT_COLUMNS = {'uid', 'pos', 'num_variants'}
+
+# Latencies kept for the percentiles; a reservoir sample keeps memory flat on 10^8-line inputs
+LATENCY_SAMPLES = 200000
+
+
+def load_annotator(name, output_dir, kb_dir=None, assembly='hg38'):
+    module_path, db_path, _ = ANNOTATORS[name]
+    if kb_dir:
+        db_path = os.path.join(kb_dir, KB_FILES[name])
+    # As in OpenCRAVAT's loader, the module's directory is importable, for its helper modules
+    sys.path.insert(0, os.path.dirname(os.path.join(ROOT, module_path)))
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, module_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    cls = module.CravatAnnotator
+    annotator = cls.__new__(cls)
+    annotator.dbconn = sqlite3.connect(os.path.join(ROOT, db_path))
+    annotator.cursor = annotator.dbconn.cursor()
+    annotator.output_dir = output_dir
+    annotator.output_basename = 'benchmark'
+    annotator.logger = logging.getLogger(name)
+    # Module options, which OpenCRAVAT reads from the module yml and the job
+    annotator.conf = {'assembly': assembly}
+    return annotator
+
+
+def iter_workload(path):
+    """Yield input_data dicts from a generate_workload.py file"""
+    with open(path) as f:
+        columns = f.readline().lstrip('#').rstrip('\n').split('\t')
+        for line in f:
+            values = line.rstrip('\n').split('\t')
+            yield {column: int(value) if column in INT_COLUMNS else value for column, value in zip(columns, values)}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def run_one(name, workload, kb_dir=None, assembly='hg38'):
+    """Benchmark one annotator in the current process and return its measurements"""
+    rng = random.Random(0)
+    samples = []
+    lines = hits = 0
+    busy_ns = 0
+    with tempfile.TemporaryDirectory() as output_dir, open(os.devnull, 'w') as devnull:
+        annotator = load_annotator(name, output_dir, kb_dir, assembly)
+        setup_start = time.perf_counter()
+        annotator.setup()
+        setup_seconds = time.perf_counter() - setup_start
+        # Annotators that print per hit would otherwise flood the report; the print itself is still timed
+        with redirect_stdout(devnull):
+            for input_data in iter_workload(workload):
+                start = time.perf_counter_ns()
+                out = annotator.annotate(input_data)
+                elapsed = time.perf_counter_ns() - start
+                busy_ns += elapsed
+                lines += 1
+                if out:
+                    hits += 1
+                if len(samples) < LATENCY_SAMPLES:
+                    samples.append(elapsed)
+                else:
+                    slot = rng.randrange(lines)
+                    if slot < LATENCY_SAMPLES:
+                        samples[slot] = elapsed
+            annotator.cleanup()
+        annotator.dbconn.close()
+    samples.sort()
+    return {
+        'workload': os.path.basename(workload),
+        'knowledgebase': os.path.basename(os.path.normpath(kb_dir)) if kb_dir else 'shipped',
+        'assembly': assembly,
+        'lines': lines,
+        'hits': hits,
+        'setup_seconds': round(setup_seconds, 4),
+        'lines_per_sec': round(lines / (busy_ns / 1e9), 1) if busy_ns else 0.0,
+        'p50_us': round(percentile(samples, 0.50) / 1e3, 2),
+        'p99_us': round(percentile(samples, 0.99) / 1e3, 2),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def compare(name, result, baseline, tolerance):
+    """Print the change against the baseline and return True if it regressed by more than tolerance"""
+    if name not in baseline:
+        print(f'{name}: no baseline')
+        return False
+    base = baseline[name]
+    if any(base.get(key) != result[key] for key in ('workload', 'lines', 'knowledgebase', 'assembly')):
+        print(f'{name}: baseline was measured on {base.get("workload")} ({base.get("lines")} lines) '
+              f'against the {base.get("knowledgebase")} knowledgebase in {base.get("assembly")}, not comparable')
+        return False
+    regressed = False
+    # (metric, True if higher is better)
+    for metric, higher_is_better in (('lines_per_sec', True), ('p50_us', False), ('p99_us', False), ('max_rss_mb', False)):
+        if not base.get(metric):
+            continue
+        change = (result[metric] - base[metric]) / base[metric]
+        worse = -change if higher_is_better else change
+        flag = ''
+        if worse > tolerance:
+            flag = '  REGRESSION'
+            regressed = True
+        print(f'{name}: {metric} {base[metric]} -> {result[metric]} ({change:+.1%}){flag}')
+    return regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the CIViC annotators without a full oc run')
+    parser.add_argument('--variant-input', help='Variant-level workload from generate_workload.py')
+    parser.add_argument('--gene-input', help='Gene-level workload from generate_workload.py')
+    parser.add_argument('--annotators', nargs='*', default=list(ANNOTATORS), choices=list(ANNOTATORS),
+                        help='Annotators to run (default: all whose level has an input)')
+    parser.add_argument('--kb-dir', help='Use generate_knowledgebase.py output instead of the shipped databases')
+    parser.add_argument('--assembly', choices=['hg38', 'hg19'], default='hg38',
+                        help='Assembly option of the civic annotator, for generate_workload.py --assembly hg19 input')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Stored baseline to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='Replace the stored results with this run')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Relative slowdown reported as a regression')
+    args = parser.parse_args()
+
+    inputs = {'variant': args.variant_input, 'gene': args.gene_input}
+    names = [name for name in args.annotators if inputs[ANNOTATORS[name][2]]]
+    if not names:
+        parser.error('give --variant-input and/or --gene-input')
+
+    results = {}
+    for name in names:
+        # A new process per annotator so the RSS figures do not include the previous one
+        with ProcessPoolExecutor(1, mp_context=get_context('spawn')) as pool:
+            results[name] = pool.submit(run_one, name, inputs[ANNOTATORS[name][2]], args.kb_dir, args.assembly).result()
+
+    print(f'{"annotator":<24} {"lines":>10} {"hits":>8} {"lines/sec":>12} {"p50 us":>8} {"p99 us":>8} {"rss MB":>8}')
+    for name, result in results.items():
+        print(f'{name:<24} {result["lines"]:>10} {result["hits"]:>8} {result["lines_per_sec"]:>12.1f} '
+              f'{result["p50_us"]:>8.2f} {result["p99_us"]:>8.2f} {result["max_rss_mb"]:>8.1f}')
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4)
+        print(f'Saved baseline to {args.baseline}', file=sys.stderr)
+    else:
+        regressed = [compare(name, result, baseline, args.tolerance) for name, result in results.items()]
+        if any(regressed):
+            sys.exit(1)
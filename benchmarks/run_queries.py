@@ -0,0 +1,94 @@
+"""Time search_civic.py's ranked queries over the shipped or generated databases.
+
+Each query is run the way one search_civic.py command runs it, including
+opening the database. The top-K queries walk the score indexes: overall, per
+gene and per disease (--top, --top --gene, --top --disease) in civic.sqlite,
+and per molecular profile (--top --profiles) in variants.db, with and without
+a --min-score threshold taken from the scores' percentiles. The keyword
+searches use terms drawn from the indexed text. Genes, diseases and terms are
+drawn at random from the databases themselves, so every query has matches.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+from generate_workload import ROOT, knowledgebase_paths
+
+sys.path.insert(0, ROOT)
+import search_civic  # noqa: E402
+
+SEARCH_TERMS = ['resistance', 'sensitivity', 'melanoma', 'kinase', 'inhibitor', 'mutation', 'amplification', 'fusion']
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def load_parameters(civic_db, variants_db):
+    """Genes, diseases and score thresholds to query, as lists to draw from"""
+    with sqlite3.connect(civic_db) as db:
+        genes = [gene for gene, in db.execute('SELECT DISTINCT gene FROM civic WHERE gene IS NOT NULL')]
+        diseases = [disease for disease, in db.execute('SELECT DISTINCT disease FROM civic_diseases')]
+        scores = sorted(score for score, in db.execute('SELECT molecular_profile_score FROM civic WHERE molecular_profile_score IS NOT NULL'))
+    with sqlite3.connect(variants_db) as db:
+        profile_scores = sorted(score for score, in db.execute(
+            'SELECT molecular_profile_score FROM profile_scores WHERE molecular_profile_score IS NOT NULL'))
+    return genes, diseases, scores, profile_scores
+
+
+def queries(rng, civic_db, civic_gene_db, variants_db, limit):
+    """(name, zero-argument function) for each kind of query"""
+    genes, diseases, scores, profile_scores = load_parameters(civic_db, variants_db)
+
+    def threshold(sorted_scores):
+        # Between the median and the top percent, where thresholds are usually set
+        return percentile(sorted_scores, rng.uniform(0.5, 0.99))
+
+    return [
+        ('top', lambda: search_civic.top_variants(civic_db, limit=limit)),
+        ('top_min_score', lambda: search_civic.top_variants(civic_db, min_score=threshold(scores), limit=limit)),
+        ('top_gene', lambda: search_civic.top_variants(civic_db, gene=rng.choice(genes), limit=limit)),
+        ('top_disease', lambda: search_civic.top_variants(civic_db, disease=rng.choice(diseases), limit=limit)),
+        ('top_disease_min_score', lambda: search_civic.top_variants(
+            civic_db, disease=rng.choice(diseases), min_score=threshold(scores), limit=limit)),
+        ('top_profiles', lambda: search_civic.top_profiles(variants_db, limit=limit)),
+        ('top_profiles_min_score', lambda: search_civic.top_profiles(variants_db, threshold(profile_scores), limit)),
+        ('search_variants', lambda: search_civic.search_variants(rng.choice(SEARCH_TERMS), civic_db, limit)),
+        ('search_genes', lambda: search_civic.search_genes(rng.choice(SEARCH_TERMS), civic_gene_db, limit)),
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time search_civic.py top-K and keyword queries')
+    parser.add_argument('--kb-dir', help='Use generate_knowledgebase.py output instead of the shipped databases')
+    parser.add_argument('--variants-db', help='Molecular profile database (default: variants.db in --kb-dir, or the shipped one)')
+    parser.add_argument('--repeat', type=int, default=1000, help='Runs of each query')
+    parser.add_argument('--limit', type=int, default=search_civic.LIMIT, help='Rows each query returns')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    civic_db, civic_gene_db, variants_db = knowledgebase_paths(args.kb_dir)
+    variants_db = args.variants_db or (variants_db if args.kb_dir else os.path.join(ROOT, search_civic.VARIANTS_DB))
+    try:
+        kinds = queries(random.Random(args.seed), civic_db, civic_gene_db, variants_db, args.limit)
+    except sqlite3.OperationalError as e:
+        # The shipped databases predate the score indexes until they are rebuilt
+        sys.exit(f'The databases lack the tables these queries use ({e}); rebuild them or use generate_knowledgebase.py output')
+
+    print(f'{"query":<24} {"runs":>8} {"rows":>8} {"queries/sec":>12} {"p50 us":>8} {"p99 us":>8}')
+    for name, query in kinds:
+        samples = []
+        rows = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter_ns()
+            rows += len(query())
+            samples.append(time.perf_counter_ns() - start)
+        samples.sort()
+        total = sum(samples) / 1e9
+        print(f'{name:<24} {args.repeat:>8} {rows / args.repeat:>8.1f} {args.repeat / total if total else 0.0:>12.1f} '
+              f'{percentile(samples, 0.50) / 1e3:>8.2f} {percentile(samples, 0.99) / 1e3:>8.2f}')
@@ -3,7 +3,27 @@ from cravat import BaseAnnotator
 from cravat import InvalidData
 import sqlite3
 import os
+import json
+from collections import defaultdict
+from profiling import profiled
+import service_client
 
+# Precomputed by create_sqlite3.py, and None from databases built before they were added
+SUMMARY_COLUMNS = [
+    'score_percentile',
+    'max_evidence_level',
+    'num_predictive_eids',
+    'num_diagnostic_eids',
+    'num_prognostic_eids',
+    'num_predisposing_eids',
+    'num_oncogenic_eids',
+    'num_functional_eids',
+]
+# Read as NULL from databases built before AND profiles were evaluated, where every row is a single-variant profile
+OPTIONAL_COLUMNS = ['variant_id', 'is_and'] + SUMMARY_COLUMNS
+PROFILE_COLUMNS = ['mp_id', 'variant_ids', 'molecular_profile_score', 'num_acc_eids', 'num_sub_eids']
+
+@profiled('civic_molecular_profile', 'setup', 'annotate', 'cleanup')
 class CravatAnnotator(BaseAnnotator):
 
     def setup(self): 
@@ -13,8 +33,38 @@ class CravatAnnotator(BaseAnnotator):
         data/example_annotator.sqlite using the sqlite3 python module. The 
         sqlite3.Connection object is stored as self.dbconn, and the 
         sqlite3.Cursor object is stored as self.cursor.
+
+        AND profiles are compiled into one bitmask per profile over the 
+        positions of its component variants. annotate only sets bits for the 
+        components it sees, and cleanup reports the profiles whose masks are 
+        complete, so the cost is proportional to the number of hits.
         """
-        pass
+        self.compound_bits = defaultdict(dict)
+        self.compound_masks = {}
+        # With CIVIC_SERVICE_URL set, lookups go to civic_service.py instead of the local database
+        self.service = service_client.connect(self.logger)
+        self.cursor.execute("SELECT name FROM pragma_table_info('variants')")
+        columns = {row[0] for row in self.cursor.fetchall()}
+        self.optional = ', '.join(column if column in columns else 'NULL' for column in OPTIONAL_COLUMNS)
+        if self.service is not None:
+            compound = self.service.compound()
+        elif 'is_and' in columns:
+            self.cursor.execute("""
+            SELECT profile_variants.mp_id, profile_variants.variant_id, profile_variants.position
+            FROM profile_variants
+            WHERE profile_variants.mp_id IN (SELECT mp_id FROM variants WHERE is_and = 1)
+            """)
+            compound = self.cursor.fetchall()
+        else:
+            compound = []
+        for mp_id, variant_id, position in compound:
+            bit = 1 << position
+            bits = self.compound_bits[variant_id]
+            bits[mp_id] = bits.get(mp_id, 0) | bit
+            self.compound_masks[mp_id] = self.compound_masks.get(mp_id, 0) | bit
+        self.compound_hits = defaultdict(int)
+        self.compound_uids = defaultdict(list)
+        self.compound_rows = {}
     
     def annotate(self, input_data, secondary_data=None):
         """
@@ -44,42 +94,71 @@ class CravatAnnotator(BaseAnnotator):
         chrom, pos, ref, alt = input_data["chrom"], input_data["pos"], input_data["ref_base"], input_data["alt_base"]
         chrom = chrom.replace("chr", "")
 
-        query = """
-        SELECT mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids
+        query = f"""
+        SELECT mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids, {self.optional}
         FROM variants
         WHERE chrom = ? AND start = ? AND ref = ? AND alt = ?
         """
 
 
 
-        # Use the variables chrom, pos, ref, and alt to fetch the data
-        self.cursor.execute(query, (chrom, pos, ref, alt))
+        if self.service is not None:
+            results = [tuple(row) for row in self.service.lookup('civic_molecular_profile', [[chrom, pos, ref, alt]])[0]]
+        else:
+            # Use the variables chrom, pos, ref, and alt to fetch the data
+            self.cursor.execute(query, (chrom, pos, ref, alt))
 
-        # Fetch the results
-        results = self.cursor.fetchall()
+            # Fetch the results
+            results = self.cursor.fetchall()
 
-        out = {}
+        profiles = []
 
         # Process the results as needed
         for result in results:
-            mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids = result
-            print(mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids)
+            mp_id, variant_id, is_and = result[0], result[5], result[6]
+            if is_and:
+                # Only one component of an AND profile is known at this point; record it for cleanup
+                self.compound_hits[mp_id] |= self.compound_bits[variant_id].get(mp_id, 0)
+                self.compound_uids[mp_id].append(input_data['uid'])
+                self.compound_rows[mp_id] = result[:5]
+                continue
+            profile = dict(zip(PROFILE_COLUMNS, result[:5]))
+            profile.update(zip(SUMMARY_COLUMNS, result[7:]))
+            profiles.append(profile)
 
-            out['mp_id'] = mp_id
-            out['variant_ids'] = variant_ids
-            out['molecular_profile_score'] = molecular_profile_score
-            out['num_acc_eids'] = num_acc_eids
-            out['num_sub_eids'] = num_sub_eids
-        
-            return out
+        if not profiles:
+            return None
+        # A variant can belong to several single-variant profiles. The columns describe the best scored
+        # one, and all_profiles lists every one of them in the same order.
+        profiles.sort(key=lambda profile: (profile['molecular_profile_score'] is None, -(profile['molecular_profile_score'] or 0)))
+        out = dict(profiles[0])
+        out['all_profiles'] = json.dumps([dict(profile, variant_ids=json.loads(profile['variant_ids'])) for profile in profiles])
+        return out
     
     def cleanup(self):
         """
         cleanup is called after every input line has been processed. Use it to
         close database connections and file handlers. Automatically opened
         database connections are also automatically closed.
+
+        AND profiles whose component variants were all seen in this job are 
+        written to <input>.civic_molecular_profile.compound.tsv next to the 
+        annotator output.
         """
-        pass
+        satisfied = [
+            mp_id for mp_id, hits in self.compound_hits.items()
+            if hits == self.compound_masks[mp_id]
+        ]
+        if not satisfied:
+            return
+        path = os.path.join(self.output_dir, self.output_basename + '.civic_molecular_profile.compound.tsv')
+        with open(path, 'w') as f:
+            print('mp_id', 'variant_ids', 'molecular_profile_score', 'num_acc_eids', 'num_sub_eids', 'uids', sep='\t', file=f)
+            for mp_id in sorted(satisfied):
+                _, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids = self.compound_rows[mp_id]
+                uids = ','.join(str(uid) for uid in sorted(set(self.compound_uids[mp_id])))
+                variant_ids = ','.join(str(variant_id) for variant_id in json.loads(variant_ids))
+                print(mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids, uids, sep='\t', file=f)
         
 if __name__ == '__main__':
     annotator = CravatAnnotator(sys.argv)
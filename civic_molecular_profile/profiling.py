@@ -0,0 +1,112 @@
+"""Opt-in profiling of annotator and builder entry points.
+
+Set CIVIC_PROFILE to 'cprofile', 'tracemalloc' or 'cprofile,tracemalloc' to
+wrap the methods named in @profiled. When the last of them returns, the
+process writes its own <basename>.<module>.<pid>.prof and .tracemalloc files
+next to the job log, and rewrites <basename>.<module>.profile.txt with a
+summary merged over all the workers of this run that have finished so far.
+Files left behind by earlier jobs with the same basename are not merged. When
+CIVIC_PROFILE is unset, @profiled returns the class unchanged, so there is no
+overhead.
+"""
+import cProfile
+import functools
+import glob
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+MODES = {mode.strip() for mode in os.environ.get('CIVIC_PROFILE', '').lower().split(',') if mode.strip()}
+SUMMARY_LINES = 40
+
+
+class _Recorder:
+    """One per process: a profiler enabled only inside the wrapped methods, and tracemalloc"""
+
+    def __init__(self, module):
+        self.module = module
+        self.profiler = cProfile.Profile() if 'cprofile' in MODES else None
+        self.output_dir = os.getcwd()
+        self.basename = None
+        self.input_path = None
+        self.started = time.time()
+        self.depth = 0
+        if 'tracemalloc' in MODES and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def call(self, method, instance, args, kwargs, last):
+        # The job's output location is only known once OpenCRAVAT has set up the annotator
+        self.output_dir = getattr(instance, 'output_dir', None) or self.output_dir
+        self.basename = getattr(instance, 'output_basename', None) or self.basename
+        self.input_path = getattr(instance, 'primary_input_path', None) or self.input_path
+        try:
+            if self.profiler is None or self.depth:
+                return method(instance, *args, **kwargs)
+            self.depth += 1
+            self.profiler.enable()
+            try:
+                return method(instance, *args, **kwargs)
+            finally:
+                self.profiler.disable()
+                self.depth -= 1
+        finally:
+            if last:
+                self.write()
+
+    def path(self, suffix):
+        prefix = f'{self.basename}.{self.module}' if self.basename else self.module
+        return os.path.join(self.output_dir, prefix + suffix)
+
+    def run_files(self, suffix):
+        """Files of this run matching suffix, leaving out those older than the run"""
+        run_start = self.started
+        if self.input_path and os.path.exists(self.input_path):
+            # The annotator's input is written when the job starts, before any of its workers
+            run_start = min(run_start, os.path.getmtime(self.input_path))
+        return sorted(path for path in glob.glob(self.path(suffix)) if os.path.getmtime(path) >= run_start)
+
+    def write(self):
+        pid = f'.{os.getpid()}'
+        if self.profiler is not None:
+            self.profiler.dump_stats(self.path(pid + '.prof'))
+        if tracemalloc.is_tracing():
+            tracemalloc.take_snapshot().dump(self.path(pid + '.tracemalloc'))
+        summary = io.StringIO()
+        profiles = self.run_files('.*.prof')
+        if profiles:
+            summary.write(f'cProfile, merged over {len(profiles)} worker(s)\n')
+            pstats.Stats(*profiles, stream=summary).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+        snapshots = self.run_files('.*.tracemalloc')
+        if snapshots:
+            totals = {}
+            for snapshot in snapshots:
+                for stat in tracemalloc.Snapshot.load(snapshot).statistics('lineno'):
+                    size, count = totals.get(str(stat.traceback), (0, 0))
+                    totals[str(stat.traceback)] = (size + stat.size, count + stat.count)
+            summary.write(f'tracemalloc, live allocations at the end of the run summed over {len(snapshots)} worker(s)\n')
+            for where, (size, count) in sorted(totals.items(), key=lambda item: -item[1][0])[:SUMMARY_LINES]:
+                summary.write(f'{size / 1024:12.1f} KiB {count:10d} blocks  {where}\n')
+        with open(self.path(pid + '.profile.tmp'), 'w') as f:
+            f.write(summary.getvalue())
+        os.replace(self.path(pid + '.profile.tmp'), self.path('.profile.txt'))
+
+
+def _wrap(recorder, method, last):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        return recorder.call(method, self, args, kwargs, last)
+    return wrapper
+
+
+def profiled(module, *names):
+    """Class decorator wrapping the named methods when CIVIC_PROFILE is set. The results are written when the last one returns."""
+    def decorate(cls):
+        if not MODES:
+            return cls
+        recorder = _Recorder(module)
+        for name in names:
+            setattr(cls, name, _wrap(recorder, getattr(cls, name), name == names[-1]))
+        return cls
+    return decorate
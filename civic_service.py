@@ -0,0 +1,324 @@
+"""Long-lived local lookup service for the CIViC annotators.
+
+Loads the civic, civic_gene and civic_molecular_profile databases into
+in-memory indexes once and answers lookups over localhost HTTP or a Unix
+socket, so annotator jobs skip setup() and cold SQLite caches. Set
+CIVIC_SERVICE_URL (http://127.0.0.1:8765 or unix:///path/to/socket) for an
+OpenCRAVAT job and the annotators use it instead of their own databases.
+
+    POST /lookup/civic                    {"keys": [[chrom, pos, ref, alt], ...], "assembly": "hg38" or "hg19"}
+    POST /lookup/civic_gene               {"keys": [hugo, ...]}
+    POST /lookup/civic_molecular_profile  {"keys": [[chrom, pos, ref, alt], ...]}
+    GET  /compound                        AND profile components, as [mp_id, variant_id, position]
+    GET  /status                          database versions and row counts
+
+Every lookup answers with {"results": [...]}, one entry per key, holding what
+the annotator's own query would have returned. The Unix socket skips HTTP,
+whose parsing costs more than a lookup: each request is one JSON line such as
+{"path": "/lookup/civic", "keys": [...]} and each answer is one JSON line.
+
+The database files are polled and, once a changed file has stopped changing,
+a complete new set of indexes is built and swapped in with a single
+assignment. Requests already running finish on the old indexes, and a build
+that fails to load keeps the old ones. SIGHUP forces a reload.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socketserver
+import sqlite3
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CIVIC_DB = os.path.join('new-annotators', 'civic', 'data', 'civic.sqlite')
+CIVIC_GENE_DB = os.path.join('new-annotators', 'civic_gene', 'data', 'civic_gene.sqlite')
+MOLECULAR_PROFILE_DB = os.path.join('civic_molecular_profile', 'data', 'civic_molecular_profile.sqlite')
+POLL_SECONDS = 10
+# Precomputed columns each annotator returns, selected as NULL from databases built before they were added
+CIVIC_SUMMARY_COLUMNS = [
+    'score_percentile', 'max_evidence_level', 'num_eids', 'num_predictive_eids', 'num_diagnostic_eids',
+    'num_prognostic_eids', 'num_predisposing_eids', 'num_oncogenic_eids', 'num_functional_eids',
+]
+PROFILE_SUMMARY_COLUMNS = [
+    'score_percentile', 'max_evidence_level', 'num_predictive_eids', 'num_diagnostic_eids',
+    'num_prognostic_eids', 'num_predisposing_eids', 'num_oncogenic_eids', 'num_functional_eids',
+]
+
+logger = logging.getLogger('civic_service')
+
+
+class AssemblyUnavailable(Exception):
+    """A lookup in an assembly the loaded civic database has no keys for"""
+
+
+def summary_columns(db, table, names):
+    columns = {row[1] for row in db.execute(f'PRAGMA table_info({table})')}
+    return ', '.join(name if name in columns else 'NULL' for name in names)
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class Indexes:
+    """Read-only in-memory copies of the three annotator databases"""
+
+    def __init__(self, civic_db, civic_gene_db, molecular_profile_db):
+        self.versions = {path: file_version(path) for path in (civic_db, civic_gene_db, molecular_profile_db)}
+        self.loaded_at = time.time()
+
+        self.civic = {'hg38': {}}
+        with sqlite3.connect(f'file:{civic_db}?mode=ro', uri=True) as db:
+            # Databases built before the GRCh37 keys were added only answer hg38 lookups
+            columns = {row[1] for row in db.execute('PRAGMA table_info(civic)')}
+            grch37 = 'NULL, NULL'
+            if 'start_grch37' in columns:
+                grch37 = 'chromosome_grch37, start_grch37'
+                self.civic['hg19'] = {}
+            summary = summary_columns(db, 'civic', CIVIC_SUMMARY_COLUMNS)
+            for civic_id, description, score, diseases, ref, alt, chrom, start, chrom_grch37, start_grch37, *values in db.execute(
+                    'SELECT id, description, molecular_profile_score, diseases, reference_base, variant_base, '
+                    f'chromosome, start, {grch37}, {summary} FROM civic ORDER BY rowid'):
+                out = {'id': civic_id, 'description': description, 'molecular_profile_score': score, 'diseases': diseases}
+                out.update(zip(CIVIC_SUMMARY_COLUMNS, values))
+                for assembly, chrom, start in (('hg38', chrom, start), ('hg19', chrom_grch37, start_grch37)):
+                    if assembly not in self.civic:
+                        continue
+                    try:
+                        key = (chrom, int(start), ref, alt)
+                    except (TypeError, ValueError):
+                        continue
+                    # The annotator takes the first matching row
+                    self.civic[assembly].setdefault(key, out)
+
+        self.gene_names = {}
+        self.gene_aliases = {}
+        with sqlite3.connect(f'file:{civic_gene_db}?mode=ro', uri=True) as db:
+            for gene_id, name, description, aliases in db.execute(
+                    'SELECT id, name, description, aliases FROM civic_gene ORDER BY rowid'):
+                out = {'id': gene_id, 'name': name, 'description': description, 'aliases': aliases}
+                self.gene_names.setdefault(name, out)
+                # The annotator matches aliases with LIKE, which ignores case, and names with ==, which does not
+                for alias in (aliases or '').split(','):
+                    self.gene_aliases.setdefault(alias.upper(), out)
+
+        self.profiles = {}
+        with sqlite3.connect(f'file:{molecular_profile_db}?mode=ro', uri=True) as db:
+            # Databases built before AND profiles were evaluated have no components, and every row is a single-variant profile
+            summary = summary_columns(db, 'variants', ['variant_id', 'is_and'] + PROFILE_SUMMARY_COLUMNS)
+            for row in db.execute(
+                    'SELECT chrom, start, ref, alt, mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids, '
+                    f'{summary} FROM variants'):
+                self.profiles.setdefault(row[:4], []).append(row[4:])
+            self.compound = []
+            if 'is_and' in {row[1] for row in db.execute('PRAGMA table_info(variants)')}:
+                self.compound = db.execute('''
+                SELECT mp_id, variant_id, position FROM profile_variants
+                WHERE mp_id IN (SELECT mp_id FROM variants WHERE is_and = 1)
+                ''').fetchall()
+        if not self.civic['hg38'] or not self.gene_names or not self.profiles:
+            raise ValueError('a database is empty, probably still being built')
+
+    def lookup(self, name, keys, assembly='hg38'):
+        if name == 'civic':
+            if assembly not in self.civic:
+                # As the annotator does with a local database, rather than answering every key with no match
+                raise AssemblyUnavailable(f'The civic database predates {assembly} keys, rebuild it to annotate {assembly} input')
+            civic = self.civic[assembly]
+            return [civic.get(tuple(key)) for key in keys]
+        if name == 'civic_gene':
+            return [self.gene(hugo) for hugo in keys]
+        if name == 'civic_molecular_profile':
+            return [self.profiles.get(tuple(key), []) for key in keys]
+        raise KeyError(name)
+
+    def gene(self, hugo):
+        if not isinstance(hugo, str):
+            return None
+        return self.gene_names.get(hugo) or self.gene_aliases.get(hugo.upper())
+
+    def status(self):
+        return {
+            'loaded_at': self.loaded_at,
+            'versions': {path: list(version) for path, version in self.versions.items()},
+            'civic': len(self.civic['hg38']),
+            'civic_grch37': len(self.civic.get('hg19', {})),
+            'civic_assemblies': sorted(self.civic),
+            'civic_gene': len(self.gene_names),
+            'civic_molecular_profile': len(self.profiles),
+        }
+
+
+def parse_request(data):
+    """Decode one request body, raising ValueError unless it is a JSON object"""
+    request = json.loads(data or b'{}')
+    if not isinstance(request, dict):
+        raise ValueError(f'the request must be a JSON object, not {type(request).__name__}')
+    return request
+
+
+def answer(indexes, path, request):
+    """Answer one request, returning (HTTP status, body)"""
+    if path == '/status':
+        return 200, indexes.status()
+    if path == '/compound':
+        return 200, {'results': indexes.compound}
+    if path.startswith('/lookup/'):
+        try:
+            results = indexes.lookup(path[len('/lookup/'):], request.get('keys', []), request.get('assembly', 'hg38'))
+        except AssemblyUnavailable as e:
+            return 404, {'error': str(e)}
+        except KeyError as e:
+            return 404, {'error': f'unknown annotator or assembly {e}'}
+        except (TypeError, ValueError) as e:
+            return 400, {'error': f'keys must be a list of lookup keys: {e}'}
+        return 200, {'results': results}
+    return 404, {'error': f'unknown path {path}'}
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in two writes; with Nagle on, the body waits for the client's delayed ACK
+    disable_nagle_algorithm = True
+
+    def send_json(self, status, body, close=False):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if close:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # One reference per request, so a reload in between cannot mix two versions
+        self.send_json(*answer(self.server.indexes, self.path, {}))
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            # The body cannot be skipped, so the connection cannot carry another request
+            self.send_json(400, {'error': 'bad Content-Length'}, close=True)
+            return
+        try:
+            request = parse_request(self.rfile.read(length))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(*answer(self.server.indexes, self.path, request))
+
+    def log_message(self, format, *args):
+        # Clients may send one request per input line; only errors are worth logging
+        pass
+
+
+class LineHandler(socketserver.StreamRequestHandler):
+    """One JSON request per line in, one JSON answer per line out, for as long as the client stays connected"""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = parse_request(line)
+                path = request.get('path', '')
+                if not isinstance(path, str):
+                    raise ValueError(f'path must be a string, not {type(path).__name__}')
+                status, body = answer(self.server.indexes, path, request)
+            except ValueError as e:
+                status, body = 400, {'error': str(e)}
+            body['status'] = status
+            self.wfile.write(json.dumps(body).encode('utf-8') + b'\n')
+
+
+class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        socketserver.UnixStreamServer.server_bind(self)
+
+
+class Reloader(threading.Thread):
+    """Rebuild the indexes when a database file has changed and then stayed unchanged for one poll"""
+
+    def __init__(self, server, paths, interval=POLL_SECONDS):
+        super().__init__(daemon=True)
+        self.server = server
+        self.paths = paths
+        self.interval = interval
+        self.wake = threading.Event()
+        self.force = False
+
+    def run(self):
+        pending = None
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                versions = {path: file_version(path) for path in self.paths}
+            except OSError:
+                # A builder may have the file removed for a moment
+                continue
+            if self.force or (versions != self.server.indexes.versions and versions == pending):
+                self.force = False
+                self.reload()
+                pending = None
+            elif versions != self.server.indexes.versions:
+                pending = versions
+
+    def reload(self):
+        try:
+            indexes = Indexes(*self.paths)
+        except (sqlite3.Error, ValueError) as e:
+            logger.error(f'Keeping the loaded databases, the new ones did not load: {e}')
+            return
+        self.server.indexes = indexes
+        logger.info(f'Reloaded: {indexes.status()}')
+
+    def request_reload(self):
+        self.force = True
+        self.wake.set()
+
+
+def make_server(url, indexes):
+    if url.startswith('unix://'):
+        server = UnixServer(url[len('unix://'):], LineHandler)
+    else:
+        host, _, port = url.replace('http://', '').rstrip('/').partition(':')
+        server = ThreadingHTTPServer((host or '127.0.0.1', int(port or 8765)), HTTPHandler)
+        server.daemon_threads = True
+    server.indexes = indexes
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve CIViC annotator lookups from in-memory indexes')
+    parser.add_argument('--listen', default='http://127.0.0.1:8765', help='http://host:port or unix:///path/to/socket')
+    parser.add_argument('--civic-db', default=CIVIC_DB, help='civic annotator database')
+    parser.add_argument('--civic-gene-db', default=CIVIC_GENE_DB, help='civic_gene annotator database')
+    parser.add_argument('--molecular-profile-db', default=MOLECULAR_PROFILE_DB, help='civic_molecular_profile database')
+    parser.add_argument('--poll', type=float, default=POLL_SECONDS, help='Seconds between checks for new databases')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(asctime)s | %(levelname)s: %(message)s')
+    paths = (args.civic_db, args.civic_gene_db, args.molecular_profile_db)
+    server = make_server(args.listen, Indexes(*paths))
+    reloader = Reloader(server, paths, args.poll)
+    reloader.start()
+    signal.signal(signal.SIGHUP, lambda signum, frame: reloader.request_reload())
+    logger.info(f'Serving on {args.listen}: {server.indexes.status()}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, UnixServer):
+            os.remove(server.server_address)
@@ -0,0 +1,305 @@
+"""Compact columnar snapshot of the civicpy cache.
+
+Loading civicpy builds its whole object graph before the first molecular
+profile can be read. This module flattens the fields the extraction scripts
+use into typed columns in a single file, which is memory-mapped on load so
+only the columns (and rows) that are actually read get paged in.
+
+File layout: MAGIC, an 8-byte little-endian header length, a JSON header
+describing every table and column, then the raw column buffers, each aligned
+to 8 bytes. Numeric columns are native arrays; string columns are a UTF-8 blob
+plus an int64 offsets array.
+"""
+from array import array
+from types import SimpleNamespace
+import argparse
+import json
+import math
+import mmap
+import struct
+import sys
+
+MAGIC = b'CIVICSNP'
+VERSION = 3
+DEFAULT_PATH = 'civic_snapshot.bin'
+
+# Column type codes: array typecodes for numbers, 'str' for strings
+SCHEMA = {
+    'profiles': {
+        'id': 'q',
+        'score': 'd',
+        'variants_start': 'q',
+        'segments_start': 'q',
+        'evidence_start': 'q',
+    },
+    'profile_variants': {
+        'variant_index': 'q',
+    },
+    'variants': {
+        'id': 'q',
+        'chrom': 'str',
+        'start': 'q',
+        'ref': 'str',
+        'alt': 'str',
+    },
+    'segments': {
+        'type': 'str',
+        'text': 'str',
+        # The variant id of variant segments, -1 for text and gene segments
+        'variant_id': 'q',
+    },
+    'evidence': {
+        'id': 'q',
+        'mp_id': 'q',
+        'status': 'str',
+        'level': 'str',
+        'type': 'str',
+        'disease': 'str',
+        'therapies': 'str',
+    },
+}
+
+
+class StringColumn:
+    """Lazily decoded view of a string column"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class SnapshotWriter:
+    """Accumulate rows per table and write them out as one snapshot file"""
+
+    def __init__(self):
+        self.columns = {
+            table: {name: [] if typecode == 'str' else array(typecode) for name, typecode in columns.items()}
+            for table, columns in SCHEMA.items()
+        }
+
+    def append(self, table, **values):
+        for name, column in self.columns[table].items():
+            column.append(values[name])
+
+    def count(self, table):
+        return len(next(iter(self.columns[table].values())))
+
+    def write(self, path):
+        header = {'version': VERSION, 'tables': {}}
+        buffers = []
+        offset = 0
+
+        def add_buffer(data):
+            nonlocal offset
+            start = offset
+            padding = -len(data) % 8
+            buffers.append(data + b'\0' * padding)
+            offset += len(data) + padding
+            return [start, len(data)]
+
+        for table, columns in self.columns.items():
+            table_header = header['tables'][table] = {'rows': self.count(table), 'columns': {}}
+            for name, column in columns.items():
+                typecode = SCHEMA[table][name]
+                if typecode == 'str':
+                    encoded = [value.encode('utf-8') for value in column]
+                    offsets = array('q', [0])
+                    for value in encoded:
+                        offsets.append(offsets[-1] + len(value))
+                    table_header['columns'][name] = {
+                        'type': typecode,
+                        'blob': add_buffer(b''.join(encoded)),
+                        'offsets': add_buffer(offsets.tobytes()),
+                    }
+                else:
+                    table_header['columns'][name] = {'type': typecode, 'data': add_buffer(column.tobytes())}
+        encoded_header = json.dumps(header).encode('utf-8')
+        encoded_header += b' ' * (-(len(MAGIC) + 8 + len(encoded_header)) % 8)
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(encoded_header)))
+            f.write(encoded_header)
+            for data in buffers:
+                f.write(data)
+
+
+class Snapshot:
+    """Memory-mapped snapshot. Tables are dicts of column views; profiles are exposed
+    with the same attribute names civicpy uses, resolved lazily from the columns."""
+
+    def __init__(self, path=DEFAULT_PATH):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{path!r} is not a CIViC snapshot')
+        header_length, = struct.unpack_from('<Q', view, len(MAGIC))
+        data_start = len(MAGIC) + 8 + header_length
+        header = json.loads(bytes(view[len(MAGIC) + 8:data_start]))
+        if header['version'] != VERSION:
+            raise ValueError(f'Unsupported snapshot version {header["version"]} in {path!r}')
+
+        def buffer(location):
+            start, length = location
+            return view[data_start + start:data_start + start + length]
+
+        self.tables = {}
+        for table, table_header in header['tables'].items():
+            columns = self.tables[table] = {}
+            for name, column in table_header['columns'].items():
+                if column['type'] == 'str':
+                    columns[name] = StringColumn(buffer(column['blob']), buffer(column['offsets']).cast('q'))
+                else:
+                    columns[name] = buffer(column['data']).cast(column['type'])
+
+    def close(self):
+        self.tables = {}
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _range(self, table, column, i):
+        """Rows of a child table belonging to profile i (children are stored grouped by profile)"""
+        starts = self.tables['profiles'][column]
+        stop = starts[i + 1] if i + 1 < len(starts) else len(next(iter(self.tables[table].values())))
+        return range(starts[i], stop)
+
+    def variant(self, i):
+        variants = self.tables['variants']
+        start = variants['start'][i]
+        coordinates = SimpleNamespace(
+            chromosome=variants['chrom'][i] or None,
+            start=start if start >= 0 else None,
+            reference_bases=variants['ref'][i] or None,
+            variant_bases=variants['alt'][i] or None,
+        )
+        return SimpleNamespace(id=variants['id'][i], coordinates=coordinates)
+
+    def profile(self, i):
+        return SnapshotProfile(self, i)
+
+    def __len__(self):
+        return len(self.tables['profiles']['id'])
+
+    def __iter__(self):
+        return (self.profile(i) for i in range(len(self)))
+
+
+class SnapshotProfile:
+    """A molecular profile row; each attribute reads only the columns it needs"""
+
+    def __init__(self, snapshot, i):
+        self._snapshot = snapshot
+        self._i = i
+
+    @property
+    def id(self):
+        return self._snapshot.tables['profiles']['id'][self._i]
+
+    @property
+    def molecular_profile_score(self):
+        score = self._snapshot.tables['profiles']['score'][self._i]
+        return None if math.isnan(score) else score
+
+    @property
+    def variants(self):
+        variant_index = self._snapshot.tables['profile_variants']['variant_index']
+        return [self._snapshot.variant(variant_index[j]) for j in self._snapshot._range('profile_variants', 'variants_start', self._i)]
+
+    @property
+    def variant_ids(self):
+        return [variant.id for variant in self.variants]
+
+    @property
+    def parsed_name(self):
+        segments = self._snapshot.tables['segments']
+        return [
+            SimpleNamespace(type=segments['type'][j], text=segments['text'][j], id=segments['variant_id'][j])
+            for j in self._snapshot._range('segments', 'segments_start', self._i)
+        ]
+
+    @property
+    def evidence_items(self):
+        evidence = self._snapshot.tables['evidence']
+        return [
+            SimpleNamespace(
+                id=evidence['id'][j],
+                status=evidence['status'][j],
+                evidence_level=evidence['level'][j] or None,
+                evidence_type=evidence['type'][j] or None,
+            )
+            for j in self._snapshot._range('evidence', 'evidence_start', self._i)
+        ]
+
+
+def build_snapshot(path=DEFAULT_PATH, include_status=('accepted', 'submitted')):
+    """Flatten the civicpy cache into a snapshot file"""
+    from civicpy import civic
+
+    writer = SnapshotWriter()
+    variant_rows = {}
+    for mp in civic.get_all_molecular_profiles(include_status=list(include_status)):
+        score = mp.molecular_profile_score
+        writer.append(
+            'profiles',
+            id=mp.id,
+            score=float('nan') if score is None else score,
+            variants_start=writer.count('profile_variants'),
+            segments_start=writer.count('segments'),
+            evidence_start=writer.count('evidence'),
+        )
+        for variant in mp.variants:
+            if variant.id not in variant_rows:
+                coordinates = variant.coordinates
+                variant_rows[variant.id] = writer.count('variants')
+                writer.append(
+                    'variants',
+                    id=variant.id,
+                    chrom=coordinates.chromosome or '',
+                    start=-1 if coordinates.start is None else coordinates.start,
+                    ref=coordinates.reference_bases or '',
+                    alt=coordinates.variant_bases or '',
+                )
+            writer.append('profile_variants', variant_index=variant_rows[variant.id])
+        for segment in mp.parsed_name:
+            writer.append(
+                'segments',
+                type=segment.type,
+                text=getattr(segment, 'text', '') or '',
+                variant_id=segment.id if segment.type == 'variant' else -1,
+            )
+        for ev in mp.evidence_items:
+            writer.append(
+                'evidence',
+                id=ev.id,
+                mp_id=mp.id,
+                status=ev.status,
+                level=ev.evidence_level or '',
+                type=ev.evidence_type or '',
+                disease=ev.disease.name if ev.disease else '',
+                therapies=','.join(sorted(therapy.name for therapy in ev.therapies)),
+            )
+    writer.write(path)
+    return writer.count('profiles')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a columnar snapshot of the civicpy cache')
+    parser.add_argument('--output', default=DEFAULT_PATH, help='Snapshot file to write')
+    args = parser.parse_args()
+    total = build_snapshot(args.output)
+    print(f'Wrote {total} molecular profiles to {args.output}', file=sys.stderr)
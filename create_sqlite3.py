@@ -1,38 +1,303 @@
+import argparse
+import itertools
 import json
 import sqlite3
 import sys
 
-# Read JSON data from stdin
-input_data = sys.stdin.read()
-data_list = json.loads(input_data)
-
-# Connect to the SQLite database (this will create a new file called 'variants.db')
-conn = sqlite3.connect('variants.db')
-cursor = conn.cursor()
-
-# Create a new table if it does not exist
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS variants (
-    chrom TEXT,
-    start INTEGER,
-    ref TEXT,
-    alt TEXT,
-    mp_id INTEGER,
-    variant_ids TEXT,
-    molecular_profile_score REAL,
-    num_acc_eids INTEGER,
-    num_sub_eids INTEGER
-)
-''')
-
-# Iterate through the list and insert each JSON object into the table
-for data in data_list:
-    variant_ids_str = json.dumps(data['variant_ids'])
+BATCH_SIZE = 1000
+# get-civicpy-data.py records are a few hundred bytes; anything this long without parsing is malformed
+MAX_RECORD_SIZE = 1 << 24
+# Columns added to variants after databases were first built, as (name, type); older databases get them in place
+ADDED_VARIANTS_COLUMNS = [
+    ('variant_id', 'INTEGER'),
+    ('is_and', 'INTEGER'),
+    ('score_percentile', 'REAL'),
+    ('max_evidence_level', 'TEXT'),
+    ('num_predictive_eids', 'INTEGER'),
+    ('num_diagnostic_eids', 'INTEGER'),
+    ('num_prognostic_eids', 'INTEGER'),
+    ('num_predisposing_eids', 'INTEGER'),
+    ('num_oncogenic_eids', 'INTEGER'),
+    ('num_functional_eids', 'INTEGER'),
+]
+EVIDENCE_LEVELS = ['A', 'B', 'C', 'D', 'E']
+# get-civicpy-data.py evidence_types keys and the variants columns counting them
+EVIDENCE_TYPE_COLUMNS = {
+    'PREDICTIVE': 'num_predictive_eids',
+    'DIAGNOSTIC': 'num_diagnostic_eids',
+    'PROGNOSTIC': 'num_prognostic_eids',
+    'PREDISPOSING': 'num_predisposing_eids',
+    'ONCOGENIC': 'num_oncogenic_eids',
+    'FUNCTIONAL': 'num_functional_eids',
+}
+
+
+def iter_json_array(stream, chunk_size=1 << 16, max_record_size=MAX_RECORD_SIZE):
+    """Yield the elements of a JSON array one at a time. The opening '[' has already been read."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    after_element = False
+    while True:
+        # Skip whitespace, reading more input once the buffer is used up
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError('Unterminated JSON array on stdin')
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer, pos = chunk, 0
+            continue
+        if buffer[pos] == ']':
+            return
+        if after_element:
+            # Fail at the first stray character instead of reading on to EOF looking for the next element
+            if buffer[pos] != ',':
+                raise ValueError(f'Expected "," or "]" after a JSON array element, found {buffer[pos]!r}')
+            pos += 1
+            after_element = False
+            continue
+        try:
+            obj, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            # The element is cut off at the end of the buffer, so append the next chunk and retry,
+            # unless it is already larger than any record could be and so must be malformed
+            if eof:
+                raise
+            if len(buffer) - pos > max_record_size:
+                raise ValueError(f'Malformed JSON array element, or one over {max_record_size} characters: {e}') from e
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        if end == len(buffer) and not eof:
+            # A bare number cut off at the end of the buffer still decodes, as a shorter one,
+            # so only accept an element once a delimiter or EOF follows it
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield obj
+        pos = end
+        after_element = True
+
+
+def iter_records(stream):
+    """Yield records from stdin, which may hold either a JSON array or newline-delimited JSON"""
+    head = stream.read(1)
+    while head.isspace():
+        head = stream.read(1)
+    if head == '[':
+        yield from iter_json_array(stream)
+    elif head:
+        for line in itertools.chain([head + stream.readline()], stream):
+            if line.strip():
+                yield json.loads(line)
+
+
+def create_tables(cursor):
+    # Clustered on the genomic key the annotator looks rows up by, so a lookup is a single primary key seek
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS variants (
+        chrom TEXT NOT NULL,
+        start INTEGER NOT NULL,
+        ref TEXT NOT NULL,
+        alt TEXT NOT NULL,
+        mp_id INTEGER NOT NULL,
+        variant_ids TEXT,
+        molecular_profile_score REAL,
+        num_acc_eids INTEGER,
+        num_sub_eids INTEGER,
+        variant_id INTEGER,
+        is_and INTEGER,
+        score_percentile REAL,
+        max_evidence_level TEXT,
+        num_predictive_eids INTEGER,
+        num_diagnostic_eids INTEGER,
+        num_prognostic_eids INTEGER,
+        num_predisposing_eids INTEGER,
+        num_oncogenic_eids INTEGER,
+        num_functional_eids INTEGER,
+        PRIMARY KEY (chrom, start, ref, alt, mp_id)
+    ) WITHOUT ROWID
+    ''')
+    # One row per component variant of a molecular profile, keyed by profile and
+    # indexed by variant so reverse lookups are index seeks instead of JSON scans
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS profile_variants (
+        mp_id INTEGER NOT NULL,
+        variant_id INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        PRIMARY KEY (mp_id, position)
+    ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS profile_variants_variant_index ON profile_variants (variant_id, mp_id)')
+    # One row per molecular profile, so top-K and score threshold queries are range scans of the score index
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS profile_scores (
+        mp_id INTEGER PRIMARY KEY,
+        molecular_profile_score REAL,
+        score_percentile REAL,
+        is_and INTEGER
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS profile_scores_score_index ON profile_scores (molecular_profile_score)')
+    # The accepted and submitted evidence items the summary columns count, one row per profile and item as civic_evidence
+    # has per variant. A variant's items are those of its profiles, found through profile_variants.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS profile_evidence (
+        mp_id INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        status TEXT,
+        level TEXT,
+        type TEXT,
+        disease TEXT,
+        therapies TEXT,
+        PRIMARY KEY (mp_id, id)
+    ) WITHOUT ROWID
+    ''')
+    migrate(cursor)
+
+
+def migrate(cursor):
+    """Add the columns a variants table built by an older version of this script lacks"""
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(variants)')}
+    for name, column_type in ADDED_VARIANTS_COLUMNS:
+        if name not in columns:
+            cursor.execute(f'ALTER TABLE variants ADD COLUMN {name} {column_type}')
+
+
+def evidence_summary(data):
+    """The profile's best evidence level (A is best) and its counts by evidence type, from get-civicpy-data.py's aggregates"""
+    levels = data.get('evidence_levels')
+    types = data.get('evidence_types')
+    if levels is None or types is None:
+        # Records written before evidence was aggregated
+        return (None,) * (1 + len(EVIDENCE_TYPE_COLUMNS))
+    max_level = next((level for level in EVIDENCE_LEVELS if levels.get(level)), None)
+    return (max_level, *(types.get(ev_type, 0) for ev_type in EVIDENCE_TYPE_COLUMNS))
+
+
+def to_row(data):
+    return (
+        data['chrom'],
+        data['start'],
+        data['ref'],
+        data['alt'],
+        data['mp_id'],
+        json.dumps(data['variant_ids']),
+        data['molecular_profile_score'],
+        data['num_acc_eids'],
+        data['num_sub_eids'],
+        data.get('variant_id'),
+        int(data.get('is_and', False)),
+        *evidence_summary(data),
+    )
+
+
+def to_profile_variant_rows(data):
+    return [(data['mp_id'], variant_id, position) for position, variant_id in enumerate(data['variant_ids'])]
+
+
+def to_evidence_rows(data):
+    # Only the first record of each profile carries its items
+    return [
+        (data['mp_id'], ev['id'], ev['status'], ev['level'], ev['type'], ev['disease'], ev['therapies'])
+        for ev in data.get('evidence_items', ())
+    ]
+
+
+def insert_records(cursor, records, batch_size=BATCH_SIZE):
+    """Insert records in fixed-size batches as they arrive, so only one batch is held in memory"""
+    total = 0
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return total
+        cursor.executemany('''
+        INSERT OR REPLACE INTO variants (chrom, start, ref, alt, mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids, variant_id, is_and,
+            max_evidence_level, num_predictive_eids, num_diagnostic_eids, num_prognostic_eids, num_predisposing_eids, num_oncogenic_eids, num_functional_eids)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [to_row(data) for data in batch])
+        # A profile has one variants row per coordinate, so its components are usually seen more than once
+        cursor.executemany('''
+        INSERT OR IGNORE INTO profile_variants (mp_id, variant_id, position)
+        VALUES (?, ?, ?)
+        ''', [row for data in batch for row in to_profile_variant_rows(data)])
+        cursor.executemany('''
+        INSERT OR REPLACE INTO profile_evidence (mp_id, id, status, level, type, disease, therapies)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', [row for data in batch for row in to_evidence_rows(data)])
+        total += len(batch)
+
+
+def rank_scores(cursor):
+    """Rank every profile's score as a percentile (0-100, ties share a rank) in profile_scores and on its variants rows"""
+    cursor.execute('DELETE FROM profile_scores')
+    # A profile has one variants row per coordinate, all with the same score, so rank profiles rather than rows
+    # Profiles without a score are ranked apart, as build_civic.py does, so they do not push every percentile up
     cursor.execute('''
-    INSERT INTO variants (chrom, start, ref, alt, mp_id, variant_ids, molecular_profile_score, num_acc_eids, num_sub_eids)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (data['chrom'], data['start'], data['ref'], data['alt'], data['mp_id'], variant_ids_str, data['molecular_profile_score'], data['num_acc_eids'], data['num_sub_eids']))
+    WITH profiles AS (
+        SELECT mp_id, MAX(molecular_profile_score) AS score, MAX(is_and) AS is_and FROM variants GROUP BY mp_id
+    ), ranked AS (
+        SELECT mp_id, 100.0 * percent_rank() OVER (ORDER BY score) AS percentile FROM profiles WHERE score IS NOT NULL
+    )
+    INSERT INTO profile_scores (mp_id, molecular_profile_score, score_percentile, is_and)
+    SELECT profiles.mp_id, profiles.score, ranked.percentile, profiles.is_and
+    FROM profiles LEFT JOIN ranked ON ranked.mp_id = profiles.mp_id
+    ''')
+    cursor.execute('''
+    UPDATE variants SET score_percentile = profile_scores.score_percentile
+    FROM profile_scores WHERE profile_scores.mp_id = variants.mp_id
+    ''')
+
+
+class VariantsDB:
+    """Bulk writer for the variants database. Scores are ranked and rows committed once, when the block exits cleanly.
+
+    By default the records are a full snapshot and replace everything already
+    loaded, so profiles and variants removed upstream disappear on reload.
+    With replace=False they are merged into the existing rows instead.
+    """
+
+    def __init__(self, path='variants.db', batch_size=BATCH_SIZE, replace=True):
+        self.path = path
+        self.batch_size = batch_size
+        self.replace = replace
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path)
+        self.cursor = self.db.cursor()
+        # Nothing reads the database while it is being loaded, so keep the rollback journal in memory
+        self.cursor.execute('PRAGMA journal_mode = MEMORY')
+        self.cursor.execute('PRAGMA synchronous = OFF')
+        create_tables(self.cursor)
+        if self.replace:
+            # Inside the load's transaction, so a failed load leaves the previous rows in place
+            for table in ('variants', 'profile_variants', 'profile_scores', 'profile_evidence'):
+                self.cursor.execute(f'DELETE FROM {table}')
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            rank_scores(self.cursor)
+            self.db.commit()
+        self.cursor.close()
+        self.db.close()
+
+    def insert_records(self, records):
+        return insert_records(self.cursor, records, self.batch_size)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load get-civicpy-data.py output (JSON array or NDJSON) from stdin into SQLite')
+    parser.add_argument('--db', default='variants.db', help='SQLite database to write')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per insert batch')
+    parser.add_argument('--append', action='store_true', help='Merge the records into the existing rows instead of replacing them')
+    args = parser.parse_args()
 
-# Commit the transaction and close the connection
-conn.commit()
-conn.close()
+    with VariantsDB(args.db, args.batch_size, replace=not args.append) as db:
+        db.insert_records(iter_records(sys.stdin))
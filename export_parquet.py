@@ -0,0 +1,210 @@
+"""Export the CIViC annotation databases as Parquet for columnar analysis.
+
+Writes one file per table to the output directory:
+    variants          variants.db rows, one per coordinate and molecular profile
+    profiles          one row per molecular profile, with its variant ids as a list
+    profile_evidence  variants.db evidence items, one per molecular profile and item
+    civic_variants    civic.sqlite variants
+    civic_evidence    civic.sqlite evidence items, one per variant and item
+    diseases          one row per civic.sqlite variant and disease
+    genes             civic_gene.sqlite genes, with their aliases as a list
+Every column of the source tables is exported, with its Arrow type taken from
+the declared SQLite type, so columns added to the databases are picked up
+without changes here; tables a database predates are left out. Genomic tables
+are sorted by chromosome (1-22, X, Y, then the rest), start, ref and alt, and
+repetitive string columns are dictionary encoded, so they load back as Arrow
+dictionary arrays. With --arrow an uncompressed Arrow IPC copy of each table
+is written too, which load() memory-maps without copying. Files an export
+does not write are removed, so load() never reads one left by an earlier run.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+
+CIVIC_DB = os.path.join('new-annotators', 'civic', 'data', 'civic.sqlite')
+CIVIC_GENE_DB = os.path.join('new-annotators', 'civic_gene', 'data', 'civic_gene.sqlite')
+ROW_GROUP_SIZE = 1 << 17
+SQLITE_TYPES = {'INT': pa.int64(), 'INTEGER': pa.int64(), 'REAL': pa.float64(), 'TEXT': pa.string()}
+# SQLite has no boolean type, so these flags are stored as 0 and 1
+BOOLEAN_COLUMNS = {'is_and'}
+# variants columns that differ between the rows of one molecular profile
+VARIANT_ROW_COLUMNS = {'chrom', 'start', 'ref', 'alt', 'variant_id'}
+# civic columns exported under the names variants uses, as (name, SQL expression, type)
+CIVIC_COLUMNS = {
+    'chromosome': ('chrom', "replace(chromosome, 'chr', '')", pa.string()),
+    'start': ('start', 'CAST(start AS INTEGER)', pa.int64()),
+    'reference_base': ('ref', 'reference_base', pa.string()),
+    'variant_base': ('alt', 'variant_base', pa.string()),
+    'chromosome_grch37': ('chrom_grch37', "replace(chromosome_grch37, 'chr', '')", pa.string()),
+}
+EVIDENCE_DICTIONARY_COLUMNS = ['status', 'level', 'type', 'direction', 'significance', 'disease']
+
+
+def chrom_order(column):
+    """SQL expression ranking chromosomes numerically, then X, Y and anything else"""
+    chrom = f"replace({column}, 'chr', '')"
+    return (f"CASE WHEN {chrom} GLOB '[0-9]*' THEN CAST({chrom} AS INTEGER) "
+            f"WHEN {chrom} = 'X' THEN 23 WHEN {chrom} = 'Y' THEN 24 ELSE 25 END, {chrom}")
+
+
+def column_fields(path, table):
+    """(name, Arrow type) for every column of table, in table order, or [] if the database predates the table"""
+    with sqlite3.connect(path) as db:
+        columns = db.execute(f'PRAGMA table_info({table})').fetchall()
+    return [
+        (name, pa.bool_() if name in BOOLEAN_COLUMNS else SQLITE_TYPES.get(declared.upper(), pa.string()))
+        for _, name, declared, *_ in columns
+    ]
+
+
+def query_table(path, query, schema):
+    """Run a query and build an Arrow table from its columns, in the order of the schema"""
+    with sqlite3.connect(path) as db:
+        rows = db.execute(query).fetchall()
+    columns = list(zip(*rows)) or [()] * len(schema)
+    arrays = []
+    for column, field in zip(columns, schema):
+        # SQLite has no boolean type, so flags come back as 0 and 1
+        if field.type == pa.bool_():
+            column = [None if value is None else bool(value) for value in column]
+        arrays.append(pa.array(column, type=field.type))
+    return pa.table(arrays, schema=schema)
+
+
+def dictionary_encode(table, names):
+    for name in names:
+        if name not in table.column_names:
+            continue
+        index = table.schema.get_field_index(name)
+        table = table.set_column(index, name, table.column(name).dictionary_encode())
+    return table
+
+
+def variant_ids_list(table):
+    """variant_ids is stored as JSON text; export it as a list of ids"""
+    index = table.schema.get_field_index('variant_ids')
+    variant_ids = pa.array([None if value is None else json.loads(value) for value in table.column('variant_ids').to_pylist()],
+                           type=pa.list_(pa.int64()))
+    return table.set_column(index, 'variant_ids', variant_ids)
+
+
+def variants_table(path):
+    fields = column_fields(path, 'variants')
+    table = query_table(path, f'''
+        SELECT {", ".join(name for name, _ in fields)}
+        FROM variants
+        ORDER BY {chrom_order('chrom')}, start, ref, alt, mp_id
+    ''', pa.schema(fields))
+    return dictionary_encode(variant_ids_list(table), ['chrom', 'ref', 'alt', 'max_evidence_level'])
+
+
+def profiles_table(path):
+    # Every row of a profile carries the same profile columns, except is_and on databases built before it was
+    fields = [(name, field_type) for name, field_type in column_fields(path, 'variants') if name not in VARIANT_ROW_COLUMNS]
+    table = query_table(path, f'''
+        SELECT {", ".join('MAX(is_and)' if name == 'is_and' else name for name, _ in fields)}
+        FROM variants
+        GROUP BY mp_id
+        ORDER BY mp_id
+    ''', pa.schema(fields))
+    return dictionary_encode(variant_ids_list(table), ['max_evidence_level'])
+
+
+def evidence_table(path, table, key):
+    """An evidence table exported as it is, sorted by the profile or variant the items belong to, or None if absent"""
+    fields = column_fields(path, table)
+    if not fields:
+        return None
+    table = query_table(path, f'SELECT {", ".join(name for name, _ in fields)} FROM {table} ORDER BY {key}, id',
+                        pa.schema(fields))
+    return dictionary_encode(table, EVIDENCE_DICTIONARY_COLUMNS)
+
+
+def civic_variants_table(path):
+    columns = [CIVIC_COLUMNS.get(name, (name, name, field_type)) for name, field_type in column_fields(path, 'civic')]
+    # The GRCh37 start is already an integer column
+    table = query_table(path, f'''
+        SELECT {", ".join(expression for _, expression, _ in columns)}
+        FROM civic
+        ORDER BY {chrom_order('chromosome')}, CAST(start AS INTEGER), reference_base, variant_base
+    ''', pa.schema([(name, field_type) for name, _, field_type in columns]))
+    return dictionary_encode(table, ['chrom', 'ref', 'alt', 'reference_build', 'chrom_grch37', 'gene', 'max_evidence_level'])
+
+
+def diseases_table(path):
+    # civic.sqlite keeps each variant's diseases as one ', '-joined string
+    with sqlite3.connect(path) as db:
+        rows = sorted(
+            (disease, variant_id)
+            for variant_id, diseases in db.execute('SELECT id, diseases FROM civic')
+            for disease in (diseases or '').split(', ') if disease
+        )
+    table = pa.table({
+        'variant_id': pa.array([variant_id for _, variant_id in rows], type=pa.int64()),
+        'disease': pa.array([disease for disease, _ in rows], type=pa.string()),
+    })
+    return dictionary_encode(table, ['disease'])
+
+
+def genes_table(path):
+    schema = pa.schema([('id', pa.int64()), ('name', pa.string()), ('description', pa.string()), ('aliases', pa.string())])
+    table = query_table(path, 'SELECT id, name, description, aliases FROM civic_gene ORDER BY name', schema)
+    aliases = pa.array([[alias for alias in (value or '').split(',') if alias] for value in table.column('aliases').to_pylist()],
+                       type=pa.list_(pa.string()))
+    return table.set_column(3, 'aliases', aliases)
+
+
+def export(output_dir, variants_db='variants.db', civic_db=CIVIC_DB, civic_gene_db=CIVIC_GENE_DB, arrow=False):
+    os.makedirs(output_dir, exist_ok=True)
+    tables = {
+        'variants': lambda: variants_table(variants_db),
+        'profiles': lambda: profiles_table(variants_db),
+        'profile_evidence': lambda: evidence_table(variants_db, 'profile_evidence', 'mp_id'),
+        'civic_variants': lambda: civic_variants_table(civic_db),
+        'civic_evidence': lambda: evidence_table(civic_db, 'civic_evidence', 'variant_id'),
+        'diseases': lambda: diseases_table(civic_db),
+        'genes': lambda: genes_table(civic_gene_db),
+    }
+    for name, build in tables.items():
+        table = build()
+        parquet_path = os.path.join(output_dir, f'{name}.parquet')
+        arrow_path = os.path.join(output_dir, f'{name}.arrow')
+        # load() prefers the Arrow copy, so one from an earlier export must not outlive the file it copied
+        for path in (arrow_path, parquet_path):
+            if os.path.exists(path):
+                os.remove(path)
+        if table is None:
+            print(f'{name}: not in the database, skipped', file=sys.stderr)
+            continue
+        pq.write_table(table, parquet_path, row_group_size=ROW_GROUP_SIZE, compression='zstd')
+        if arrow:
+            with pa.OSFile(arrow_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table, max_chunksize=ROW_GROUP_SIZE)
+        print(f'{name}: {table.num_rows} rows', file=sys.stderr)
+
+
+def load(name, directory='parquet'):
+    """Load an exported table. Arrow IPC copies are memory-mapped without copying; Parquet is read through a memory map."""
+    arrow_path = os.path.join(directory, f'{name}.arrow')
+    if os.path.exists(arrow_path):
+        return pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    return pq.read_table(os.path.join(directory, f'{name}.parquet'), memory_map=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the CIViC annotation databases as Parquet')
+    parser.add_argument('--variants-db', default='variants.db', help='create_sqlite3.py output')
+    parser.add_argument('--civic-db', default=CIVIC_DB, help='civic annotator database')
+    parser.add_argument('--civic-gene-db', default=CIVIC_GENE_DB, help='civic_gene annotator database')
+    parser.add_argument('--output-dir', default='parquet', help='Directory for the exported files')
+    parser.add_argument('--arrow', action='store_true', help='Also write uncompressed Arrow IPC files for zero-copy loads')
+    args = parser.parse_args()
+
+    export(args.output_dir, args.variants_db, args.civic_db, args.civic_gene_db, args.arrow)
@@ -1,53 +1,347 @@
-from civicpy import civic
+from types import SimpleNamespace
+import argparse
+import json
 import sys
 
-annotated_mps = list()
-molecular_profiles = civic.get_all_molecular_profiles(include_status=["accepted", "submitted"])
-for n, mp in enumerate(molecular_profiles):
-    # if n > 10:
-    #     break
-    ev_counts = {
-        "accepted": 0,
-        "submitted": 0
+import numpy as np
+import pandas as pd
+
+from profile_expressions import parse, to_dnf
+
+INCLUDE_STATUS = ["accepted", "submitted"]
+EVIDENCE_LEVELS = ["A", "B", "C", "D", "E"]
+EVIDENCE_TYPES = ["PREDICTIVE", "DIAGNOSTIC", "PROGNOSTIC", "PREDISPOSING", "ONCOGENIC", "FUNCTIONAL"]
+EVIDENCE_COLUMNS = ["mp_id", "status", "level", "type", "disease", "therapies", "id"]
+GRAPHQL_URL = 'https://civicdb.org/api/graphql'
+EVIDENCE_PAGE_SIZE = 100
+EVIDENCE_FIELDS = """
+    pageInfo {
+        endCursor
+        hasNextPage
     }
-    for ev in mp.evidence_items:
-        if ev.status in {"accepted", "submitted"}:
-            ev_counts[ev.status] += 1
-    is_and = False
-    # print(gq_mp)
-    for parsed_name in mp.parsed_name:
-        if parsed_name.type == 'molecular_profile_text_segment':
-            if parsed_name.text == 'OR':
-                is_and = False
-            elif parsed_name.text == 'AND':
-                is_and = True
-            else:
-                print('Unrecognized token text: ' + parsed_name.text, file=sys.stderr)
-            break
-    if is_and:
-        continue
-    
-    
-    for variant in mp.variants:
-        chrom = None
-        start = None
-        ref = None
-        alt = None
-        coordinates = variant.coordinates
-        # molecular_profile_id = variant.single_variant_molecular_profile
-        chrom, start, ref, alt = coordinates.chromosome, coordinates.start, coordinates.reference_bases, coordinates.variant_bases
-        if not (ref and alt):
-            continue
-        annotated_mps.append({
-            "chrom": chrom,
-            "start": start,
-            "ref": ref,
-            "alt": alt,
-            "mp_id": mp.id,
-            "variant_ids": mp.variant_ids,
-            "molecular_profile_score": mp.molecular_profile_score,
-            "num_acc_eids": ev_counts["accepted"],
-            "num_sub_eids": ev_counts["submitted"],
+    nodes {
+        id
+        status
+        evidenceLevel
+        evidenceType
+        disease {
+            name
+        }
+        therapies {
+            name
+        }
+    }
+"""
+PROFILES_QUERY = """query molecularProfiles($first: Int, $after: String, $evidenceFirst: Int) {
+    molecularProfiles(first: $first, after: $after) {
+        pageInfo {
+            endCursor
+            hasNextPage
+        }
+        nodes {
+            id
+            molecularProfileScore
+            parsedName {
+                __typename
+                ... on MolecularProfileTextSegment {
+                    text
+                }
+                ... on Variant {
+                    id
+                }
+            }
+            variants {
+                id
+                referenceBases
+                variantBases
+                primaryCoordinates {
+                    chromosome
+                    start
+                }
+            }
+            evidenceItems(first: $evidenceFirst) {%s}
+        }
+    }
+}
+""" % EVIDENCE_FIELDS
+PROFILE_EVIDENCE_QUERY = """query molecularProfileEvidence($id: Int!, $first: Int, $after: String) {
+    molecularProfile(id: $id) {
+        evidenceItems(first: $first, after: $after) {%s}
+    }
+}
+""" % EVIDENCE_FIELDS
+
+parser = argparse.ArgumentParser(description='Extract CIViC molecular profile variants as JSON')
+parser.add_argument('--ndjson', action='store_true', help='Write one JSON object per line as each profile is processed')
+parser.add_argument('--snapshot', help='Read profiles from a civic_snapshot.py file instead of the civicpy cache')
+parser.add_argument('--db', help='Write rows straight into this variants database instead of printing JSON')
+parser.add_argument('--json', help='With --db, also write the rows to this file as a JSON array')
+parser.add_argument('--graphql', action='store_true', help='Page through profiles with the CIViC GraphQL API instead of the civicpy cache')
+parser.add_argument('--chunk-size', type=int, default=100, help='Profiles per page with --graphql or --snapshot')
+args = parser.parse_args()
+
+
+def load_snapshot_evidence(snapshot, start=0, stop=None):
+    """Evidence table straight from the snapshot columns; ids are wrapped without copying"""
+    columns = snapshot.tables['evidence']
+    stop = len(columns['mp_id']) if stop is None else stop
+    evidence = {"mp_id": np.frombuffer(columns['mp_id'], dtype=np.int64)[start:stop]}
+    for name in EVIDENCE_COLUMNS[1:]:
+        evidence[name] = [columns[name][i] for i in range(start, stop)]
+    return pd.DataFrame(evidence)
+
+
+def evidence_record(mp_id, ev):
+    return (
+        mp_id,
+        ev.status,
+        ev.evidence_level,
+        ev.evidence_type,
+        ev.disease.name if ev.disease else None,
+        ",".join(sorted(therapy.name for therapy in ev.therapies)),
+        ev.id,
+    )
+
+
+def load_civicpy_evidence():
+    return pd.DataFrame.from_records([
+        evidence_record(ev.molecular_profile_id, ev)
+        for ev in civic.get_all_evidence(include_status=INCLUDE_STATUS)
+    ], columns=EVIDENCE_COLUMNS)
+
+
+def iter_civicpy_chunks():
+    """civicpy loads its whole cache up front, so it can only be read as one chunk"""
+    yield civic.get_all_molecular_profiles(include_status=INCLUDE_STATUS), load_civicpy_evidence()
+
+
+def iter_snapshot_chunks(snapshot, chunk_size):
+    """Profiles (and their evidence rows, which are stored grouped by profile) in fixed-size ranges"""
+    evidence_start = snapshot.tables['profiles']['evidence_start']
+    for start in range(0, len(snapshot), chunk_size):
+        stop = min(start + chunk_size, len(snapshot))
+        evidence_stop = evidence_start[stop] if stop < len(snapshot) else None
+        profiles = [snapshot.profile(i) for i in range(start, stop)]
+        yield profiles, load_snapshot_evidence(snapshot, evidence_start[start], evidence_stop)
+
+
+def graphql_evidence_item(node):
+    """Evidence node in the shape civicpy uses; GraphQL enums are upper case"""
+    return SimpleNamespace(
+        id=node['id'],
+        status=node['status'].lower(),
+        evidence_level=node['evidenceLevel'],
+        evidence_type=node['evidenceType'],
+        disease=SimpleNamespace(name=node['disease']['name']) if node['disease'] else None,
+        therapies=[SimpleNamespace(name=therapy['name']) for therapy in node['therapies']],
+    )
+
+
+def graphql_profile(session, node):
+    """Molecular profile node in the shape civicpy uses, following the evidence connection past its first page"""
+    evidence = node['evidenceItems']
+    evidence_nodes = list(evidence['nodes'])
+    while evidence['pageInfo']['hasNextPage']:
+        response = session.post(GRAPHQL_URL, json={
+            'query': PROFILE_EVIDENCE_QUERY,
+            'variables': {'id': node['id'], 'first': EVIDENCE_PAGE_SIZE, 'after': evidence['pageInfo']['endCursor']},
+        }, timeout=60)
+        response.raise_for_status()
+        evidence = response.json()['data']['molecularProfile']['evidenceItems']
+        evidence_nodes.extend(evidence['nodes'])
+    variants = [
+        SimpleNamespace(
+            id=variant['id'],
+            coordinates=SimpleNamespace(
+                chromosome=(variant['primaryCoordinates'] or {}).get('chromosome'),
+                start=(variant['primaryCoordinates'] or {}).get('start'),
+                reference_bases=variant['referenceBases'],
+                variant_bases=variant['variantBases'],
+            ),
+        )
+        for variant in node['variants']
+    ]
+    return SimpleNamespace(
+        id=node['id'],
+        molecular_profile_score=node['molecularProfileScore'],
+        parsed_name=[
+            SimpleNamespace(type='molecular_profile_text_segment', text=segment['text'])
+            if segment['__typename'] == 'MolecularProfileTextSegment' else SimpleNamespace(type='variant', id=segment['id'])
+            for segment in node['parsedName'] if segment['__typename'] in ('MolecularProfileTextSegment', 'Variant')
+        ],
+        variants=variants,
+        variant_ids=[variant.id for variant in variants],
+        evidence_items=[graphql_evidence_item(ev) for ev in evidence_nodes],
+    )
+
+
+def iter_graphql_chunks(chunk_size):
+    """Page through the molecularProfiles connection; each page is released once its rows are consumed"""
+    import requests
+
+    with requests.Session() as session:
+        cursor = None
+        while True:
+            response = session.post(GRAPHQL_URL, json={
+                'query': PROFILES_QUERY,
+                'variables': {'first': chunk_size, 'after': cursor, 'evidenceFirst': EVIDENCE_PAGE_SIZE},
+            }, timeout=120)
+            response.raise_for_status()
+            connection = response.json()['data']['molecularProfiles']
+            profiles = [graphql_profile(session, node) for node in connection['nodes']]
+            # Match civicpy's include_status: keep profiles with at least one accepted or submitted item
+            profiles = [mp for mp in profiles if any(ev.status in INCLUDE_STATUS for ev in mp.evidence_items)]
+            evidence = pd.DataFrame.from_records(
+                [evidence_record(mp.id, ev) for mp in profiles for ev in mp.evidence_items],
+                columns=EVIDENCE_COLUMNS,
+            )
+            yield profiles, evidence
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            cursor = connection['pageInfo']['endCursor']
+
+
+def aggregate_evidence(evidence):
+    """Count evidence items per profile by status, level and type in one grouped pass each"""
+    evidence = evidence[evidence["status"].isin(INCLUDE_STATUS)]
+
+    def counts(column, values, index=None):
+        return pd.crosstab(evidence["mp_id"], evidence[column]).reindex(index=index, columns=values, fill_value=0)
+
+    status_counts = counts("status", INCLUDE_STATUS)
+    # crosstab drops rows whose level or type is missing, so a profile whose items all lack one would
+    # be missing from that table; line every table up on the same profiles before assigning by position
+    aggregates = pd.DataFrame({
+        "num_acc_eids": status_counts["accepted"],
+        "num_sub_eids": status_counts["submitted"],
+    })
+    aggregates["evidence_levels"] = counts("level", EVIDENCE_LEVELS, status_counts.index).to_dict("records")
+    aggregates["evidence_types"] = counts("type", EVIDENCE_TYPES, status_counts.index).to_dict("records")
+    aggregates = aggregates.to_dict("index")
+    # The items themselves, for create_sqlite3.py's profile_evidence table; the snapshot stores missing values as ''
+    for ev in evidence.itertuples(index=False):
+        aggregates[ev.mp_id].setdefault("evidence_items", []).append({
+            "id": int(ev.id),
+            "status": ev.status,
+            "level": ev.level or None,
+            "type": ev.type or None,
+            "disease": ev.disease or None,
+            "therapies": ev.therapies or None,
         })
-import json
-print(json.dumps(annotated_mps, indent=4))
\ No newline at end of file
+    return aggregates
+
+
+def is_and_profile(mp):
+    """True when the profile needs all of its variants, False when any one of them is enough.
+
+    Rows only say whether every component is required, so profiles that need
+    more than that, such as A AND NOT B or (A AND B) OR C, raise ValueError.
+    """
+    segments = []
+    for segment in mp.parsed_name:
+        if segment.type == 'molecular_profile_text_segment':
+            segments.append({'__typename': 'MolecularProfileTextSegment', 'text': segment.text})
+        elif segment.type == 'variant':
+            segments.append({'__typename': 'Variant', 'id': segment.id})
+    clauses = to_dnf(parse(segments))
+    if len(clauses) == 1 and not clauses[0][1]:
+        return len(clauses[0][0]) > 1
+    if all(len(required) == 1 and not forbidden for required, forbidden in clauses):
+        return False
+    raise ValueError('combines AND with OR or NOT')
+
+
+def iter_rows(molecular_profiles, evidence_aggregates):
+    """Yield one output row per profile variant with coordinates, as soon as it is built"""
+    no_evidence = {
+        "num_acc_eids": 0,
+        "num_sub_eids": 0,
+        "evidence_levels": dict.fromkeys(EVIDENCE_LEVELS, 0),
+        "evidence_types": dict.fromkeys(EVIDENCE_TYPES, 0),
+        "evidence_items": [],
+    }
+    for n, mp in enumerate(molecular_profiles):
+        # if n > 10:
+        #     break
+        ev_counts = evidence_aggregates.get(mp.id, no_evidence)
+        try:
+            is_and = is_and_profile(mp)
+        except ValueError as e:
+            # Leave the profile out rather than report it for variant sets that do not satisfy it
+            print(f'Skipping molecular profile {mp.id}: {e}', file=sys.stderr)
+            continue
+
+        first = True
+        for variant in mp.variants:
+            chrom = None
+            start = None
+            ref = None
+            alt = None
+            coordinates = variant.coordinates
+            # molecular_profile_id = variant.single_variant_molecular_profile
+            chrom, start, ref, alt = coordinates.chromosome, coordinates.start, coordinates.reference_bases, coordinates.variant_bases
+            if not (ref and alt):
+                continue
+            row = {
+                "chrom": chrom,
+                "start": start,
+                "ref": ref,
+                "alt": alt,
+                "mp_id": mp.id,
+                "variant_id": variant.id,
+                "variant_ids": mp.variant_ids,
+                "is_and": is_and,
+                "molecular_profile_score": mp.molecular_profile_score,
+                "num_acc_eids": int(ev_counts["num_acc_eids"]),
+                "num_sub_eids": int(ev_counts["num_sub_eids"]),
+                "evidence_levels": {level: int(count) for level, count in ev_counts["evidence_levels"].items()},
+                "evidence_types": {ev_type: int(count) for ev_type, count in ev_counts["evidence_types"].items()},
+            }
+            if first:
+                # The items belong to the profile, so they are written once rather than with every coordinate
+                row["evidence_items"] = ev_counts.get("evidence_items", [])
+                first = False
+            yield row
+
+
+def tee_json(rows, f):
+    """Pass rows through unchanged while streaming them to f as a JSON array"""
+    f.write('[')
+    for n, row in enumerate(rows):
+        f.write(',\n' if n else '\n')
+        f.write(json.dumps(row))
+        yield row
+    f.write('\n]\n')
+
+
+def iter_chunk_rows(chunks):
+    """Rows for one chunk of profiles at a time, aggregating each chunk's evidence in one pass"""
+    for molecular_profiles, evidence in chunks:
+        yield from iter_rows(molecular_profiles, aggregate_evidence(evidence))
+
+
+if args.snapshot:
+    from civic_snapshot import Snapshot
+    chunks = iter_snapshot_chunks(Snapshot(args.snapshot), args.chunk_size)
+elif args.graphql:
+    chunks = iter_graphql_chunks(args.chunk_size)
+else:
+    from civicpy import civic
+    chunks = iter_civicpy_chunks()
+rows = iter_chunk_rows(chunks)
+
+if args.db:
+    from create_sqlite3 import VariantsDB
+    with VariantsDB(args.db) as db:
+        if args.json:
+            with open(args.json, 'w') as f:
+                total = db.insert_records(tee_json(rows, f))
+        else:
+            total = db.insert_records(rows)
+    print(f'Inserted {total} rows into {args.db}', file=sys.stderr)
+elif args.ndjson:
+    for row in rows:
+        print(json.dumps(row), flush=True)
+else:
+    annotated_mps = list(rows)
+    print(json.dumps(annotated_mps, indent=4))
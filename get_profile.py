@@ -1,12 +1,23 @@
+import argparse
+import contextlib
 import csv
-import sys 
-from civicpy import civic
-import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from profile_store import ProfileStore
+
+class GraphQLError(requests.RequestException):
+    """A 200 response whose body reports errors or carries no profile"""
+
 
-def fetch_molecular_profile(mpId):
+def fetch_molecular_profile(mpId, session=requests):
     url = 'https://civicdb.org/api/graphql'
 
     query = """
@@ -43,25 +54,92 @@ def fetch_molecular_profile(mpId):
 
     variables = {"mpId": mpId}
 
-    response = requests.post(url, json={'query': query, 'variables': variables})
-    if response.status_code == 200:
-        return response.json()
-    else:
-        response.raise_for_status()
+    response = session.post(url, json={'query': query, 'variables': variables}, timeout=30)
+    response.raise_for_status()
+    result = response.json()
+    # GraphQL reports failures such as rate limits or an unknown id in the body of a 200,
+    # so only a response with the profile in it counts as fetched
+    if result.get('errors') or not (result.get('data') or {}).get('molecularProfile'):
+        raise GraphQLError(f"no molecular profile {mpId} in the response: {result.get('errors')}", response=response)
+    return result
 
-reader = csv.reader(sys.stdin)
 
-writer = csv.writer(sys.stdout)
+def make_session(pool_size):
+    """Session with a connection pool sized for the worker threads and retries with backoff"""
+    retry = Retry(total=5, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504), allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    return session
 
-counter = collections.defaultdict(int)
-results = []
 
-for row in reader:
-    chrom, start, ref, var, molecular_profile_id  = row
-    print(civic.get_molecular_profile_by_id(molecular_profile_id))
-    
-    result = fetch_molecular_profile(int(molecular_profile_id))
+def file_fetched_at(out_dir, mp_id):
+    try:
+        return os.path.getmtime(os.path.join(out_dir, f"{mp_id}.json"))
+    except OSError:
+        return 0
+
+
+def fetch_profile(session, molecular_profile_id):
+    result = fetch_molecular_profile(int(molecular_profile_id), session)
     result["molecular_profile_id"] = molecular_profile_id
-    results.append(result)
-    with open(f"variants/{molecular_profile_id}.json", "w") as fp:
+    return result
+
+
+def save_profile(result, out_dir):
+    # Write to a temporary name first so an interrupted run never leaves a truncated file that looks fresh
+    path = os.path.join(out_dir, f"{result['molecular_profile_id']}.json")
+    with open(path + ".tmp", "w") as fp:
         print(json.dumps(result, indent=4), file=fp)
+    os.replace(path + ".tmp", path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch the parsed name of every molecular profile listed in molecular_ids.csv on stdin')
+    parser.add_argument('--out-dir', default='variants', help='Directory for the per-profile JSON files')
+    parser.add_argument('--store', help='Write profiles to this profile_store.py file instead of --out-dir')
+    parser.add_argument('--workers', type=int, default=8, help='Concurrent requests')
+    parser.add_argument('--max-age', type=float, default=7, help='Refetch profiles whose file is older than this many days')
+    args = parser.parse_args()
+
+    reader = csv.reader(sys.stdin)
+
+    # The CSV has one row per variant coordinate, so the same profile id shows up many times
+    molecular_profile_ids = list(dict.fromkeys(row[4] for row in reader))
+
+    with contextlib.ExitStack() as stack:
+        if args.store:
+            store = stack.enter_context(ProfileStore(args.store))
+
+            def fetched_at(mp_id):
+                return store.fetched_at(mp_id) or 0
+
+            def save(result):
+                store.put(result["molecular_profile_id"], result)
+        else:
+            os.makedirs(args.out_dir, exist_ok=True)
+
+            def fetched_at(mp_id):
+                return file_fetched_at(args.out_dir, mp_id)
+
+            def save(result):
+                save_profile(result, args.out_dir)
+
+        stale_before = time.time() - args.max_age * 86400
+        missing = [mp_id for mp_id in molecular_profile_ids if fetched_at(mp_id) < stale_before]
+        print(f"{len(molecular_profile_ids)} profiles, {len(missing)} to fetch", file=sys.stderr)
+
+        failed = []
+        session = stack.enter_context(make_session(args.workers))
+        pool = stack.enter_context(ThreadPoolExecutor(args.workers))
+        futures = {pool.submit(fetch_profile, session, mp_id): mp_id for mp_id in missing}
+        for future in as_completed(futures):
+            try:
+                # Results are saved from this thread, so the store connection is never shared between threads
+                save(future.result())
+            except requests.RequestException as e:
+                failed.append(futures[future])
+                print(f"Failed to fetch molecular profile {futures[future]}: {e}", file=sys.stderr)
+    if failed:
+        # Re-running only fetches these, since everything else is now fresh on disk
+        sys.exit(f"{len(failed)} profiles failed")
@@ -1,18 +1,117 @@
+import argparse
 import os
 import json
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
 
-# Initialize an empty dictionary to store the results
-result = {}
-
-# Iterate through every file in the "variants" directory
-for filename in os.listdir('variants'):
-    if filename.endswith('.json'):
-        filepath = os.path.join('variants', filename)
-        # Open each JSON file and load its contents
-        with open(filepath, 'r') as file:
-            data = json.load(file)
-            # Assuming each JSON file contains a dictionary, you can update the result dictionary with its contents
-            result[data["molecular_profile_id"]] = data
-
-# Result now contains the combined contents of all the JSON files in the "variants" directory
-print(json.dumps(result, indent=4))
+# Below this many changed files, starting a process pool costs more than it saves
+PARALLEL_THRESHOLD = 256
+
+
+def parse_file(filepath):
+    """Parse one profile file and pre-render the fragments the merged output is assembled from"""
+    with open(filepath, 'r') as file:
+        data = json.load(file)
+    key = json.dumps(data["molecular_profile_id"])
+    compact = key + ':' + json.dumps(data, separators=(',', ':'))
+    indented = '    ' + key + ': ' + json.dumps(data, indent=4).replace('\n', '\n    ')
+    return compact, indented
+
+
+class MergeCache:
+    """Rendered fragments of every profile file, keyed by directory and file name and invalidated by mtime and size"""
+
+    def __init__(self, path, directory):
+        self.path = path
+        # Resolved, so one cache shared by several --dir values never serves one directory's files for another
+        self.directory = os.path.realpath(directory)
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS profile_files (
+            directory TEXT,
+            filename TEXT,
+            mtime_ns INTEGER,
+            size INTEGER,
+            compact TEXT,
+            indented TEXT,
+            PRIMARY KEY (directory, filename)
+        )''')
+        # Caches written before the directory was part of the key
+        self.db.execute('DROP TABLE IF EXISTS files')
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.db.commit()
+        self.db.close()
+
+    def stats(self):
+        return {filename: (mtime_ns, size) for filename, mtime_ns, size in self.db.execute(
+            'SELECT filename, mtime_ns, size FROM profile_files WHERE directory = ?', (self.directory,))}
+
+    def put(self, rows):
+        self.db.executemany('INSERT OR REPLACE INTO profile_files VALUES (?, ?, ?, ?, ?, ?)', [(self.directory, *row) for row in rows])
+
+    def delete(self, filenames):
+        self.db.executemany('DELETE FROM profile_files WHERE directory = ? AND filename = ?',
+                            [(self.directory, filename) for filename in filenames])
+
+    def fragments(self, column):
+        return dict(self.db.execute(f'SELECT filename, {column} FROM profile_files WHERE directory = ?', (self.directory,)))
+
+
+def merge_directory(directory, cache_path, compact=False, workers=None):
+    """Write the merged profiles to stdout, only re-parsing files that changed since the last run"""
+    current = {}
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.json'):
+            stat = entry.stat()
+            current[entry.name] = (stat.st_mtime_ns, stat.st_size)
+
+    with MergeCache(cache_path, directory) as cache:
+        cached = cache.stats()
+        changed = [filename for filename, stat in current.items() if cached.get(filename) != stat]
+        paths = [os.path.join(directory, filename) for filename in changed]
+        if len(changed) >= PARALLEL_THRESHOLD:
+            with ProcessPoolExecutor(workers) as pool:
+                rendered = list(pool.map(parse_file, paths, chunksize=64))
+        else:
+            rendered = [parse_file(path) for path in paths]
+        cache.put([(filename, *current[filename], *fragments) for filename, fragments in zip(changed, rendered)])
+        cache.delete([filename for filename in cached if filename not in current])
+        print(f'Parsed {len(changed)} of {len(current)} profile files', file=sys.stderr)
+
+        fragments = cache.fragments('compact' if compact else 'indented')
+        if compact or not current:
+            print('{' + ','.join(fragments[filename] for filename in current) + '}')
+        else:
+            print('{\n' + ',\n'.join(fragments[filename] for filename in current) + '\n}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge the fetched molecular profiles into one JSON object keyed by profile id')
+    parser.add_argument('--store', help='Read profiles from this profile_store.py file instead of the variants directory')
+    parser.add_argument('--dir', default='variants', help='Directory of per-profile JSON files')
+    parser.add_argument('--cache', default='mergefiles.cache.sqlite', help='Cache of already parsed profile files')
+    parser.add_argument('--compact', action='store_true', help='Write compact JSON instead of indenting it')
+    parser.add_argument('--workers', type=int, help='Processes used to parse changed files on a cold run')
+    args = parser.parse_args()
+
+    if args.store:
+        from profile_store import ProfileStore
+
+        # The store already holds one parsed profile per id, so write them out one at a time
+        with ProfileStore(args.store) as store:
+            sys.stdout.write('{')
+            n = -1
+            for n, (mp_id, data) in enumerate(store.booleans().items()):
+                if args.compact:
+                    sys.stdout.write((',' if n else '') + json.dumps(mp_id) + ':' + json.dumps(data, separators=(',', ':')))
+                else:
+                    sys.stdout.write(',\n    ' if n else '\n    ')
+                    sys.stdout.write(json.dumps(mp_id) + ': ' + json.dumps(data, indent=4).replace('\n', '\n    '))
+            print('}' if args.compact or n < 0 else '\n}')
+    else:
+        merge_directory(args.dir, args.cache, args.compact, args.workers)
@@ -1,28 +1,65 @@
 import sys
 from cravat import BaseAnnotator
+from profiling import profiled
+import service_client
 
+# The assembly option (civic.yml) is the assembly of the coordinates this annotator is given. OpenCRAVAT lifts
+# its input to hg38 before annotation; a job feeding original GRCh37 coordinates sets it to hg19 with
+# --module-option civic.assembly=hg19, so no liftover is needed.
+ASSEMBLIES = {'hg38': 'hg38', 'grch38': 'hg38', 'hg19': 'hg19', 'grch37': 'hg19'}
+COORDINATE_COLUMNS = {'hg38': ('chromosome', 'start'), 'hg19': ('chromosome_grch37', 'start_grch37')}
+# Precomputed by the builder, and None from databases built before they were added
+SUMMARY_COLUMNS = [
+    'score_percentile',
+    'max_evidence_level',
+    'num_eids',
+    'num_predictive_eids',
+    'num_diagnostic_eids',
+    'num_prognostic_eids',
+    'num_predisposing_eids',
+    'num_oncogenic_eids',
+    'num_functional_eids',
+]
 
+
+@profiled('civic', 'setup', 'annotate', 'cleanup')
 class CravatAnnotator(BaseAnnotator):
-    def annotate(self, input_data, secondary_data=None):
-        q = '''SELECT
+    def setup(self):
+        assembly = str(self.conf.get('assembly', 'hg38'))
+        self.assembly = ASSEMBLIES.get(assembly.lower())
+        if self.assembly is None:
+            raise ValueError(f'The civic assembly option must be one of {", ".join(ASSEMBLIES)}, not {assembly!r}')
+        self.service = service_client.connect(self.logger)
+        if self.service is not None:
+            # The service answers an assembly its database has no keys for with an error, so fail here instead
+            if self.assembly not in self.service.status()['civic_assemblies']:
+                raise ValueError(f'The civic database predates {self.assembly} keys, rebuild it to annotate {self.assembly} input')
+            return
+        chromosome, start = COORDINATE_COLUMNS[self.assembly]
+        columns = {row[1] for row in self.cursor.execute('PRAGMA table_info(civic)')}
+        if start not in columns:
+            raise ValueError(f'The civic database predates {self.assembly} keys, rebuild it to annotate {self.assembly} input')
+        summary = ', '.join(column if column in columns else 'NULL' for column in SUMMARY_COLUMNS)
+        # Each assembly's columns have their own index, so either query is an index seek
+        self.query = f'''SELECT
                 id,
                 description,
                 molecular_profile_score,
                 diseases,
-                chromosome,
-                start,
-                reference_base,
-                reference_build,
-                variant_base
+                {summary}
             FROM civic
-            WHERE chromosome = ? AND start = ? AND reference_base = ? AND variant_base = ?
+            WHERE {chromosome} = ? AND {start} = ? AND reference_base = ? AND variant_base = ?
         '''
+
+    def annotate(self, input_data, secondary_data=None):
         chrom = input_data['chrom']
         pos = input_data['pos']
         ref = input_data['ref_base']
         alt = input_data['alt_base']
         params = (chrom, pos, ref, alt)
-        self.cursor.execute(q, params)
+        if self.service is not None:
+            return self.service.lookup('civic', [params], self.assembly)[0]
+        self.cursor.execute(self.query, params)
         row = self.cursor.fetchone()
         if row:
             out = {
@@ -31,6 +68,7 @@ class CravatAnnotator(BaseAnnotator):
                 'molecular_profile_score': row[2],
                 'diseases': row[3]
             }
+            out.update(zip(SUMMARY_COLUMNS, row[4:]))
             return out
 
 
@@ -0,0 +1,100 @@
+"""Thin client for civic_service.py.
+
+When CIVIC_SERVICE_URL is set (http://host:port or unix:///path/to/socket),
+the annotator sends its lookups to the shared service over one persistent
+connection instead of querying its own database. Over the Unix socket each
+request and answer is a single JSON line.
+"""
+import http.client
+import json
+import os
+import socket
+
+SERVICE_URL = os.environ.get('CIVIC_SERVICE_URL')
+
+
+class HTTPTransport:
+    def __init__(self, host, timeout):
+        self.connection = http.client.HTTPConnection(host, timeout=timeout)
+
+    def send(self, path, body):
+        if body is None:
+            self.connection.request('GET', path)
+        else:
+            self.connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        response = self.connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    def close(self):
+        self.connection.close()
+
+
+class UnixTransport:
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+
+    def send(self, path, body):
+        if self.sock is None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            self.sock.connect(self.path)
+            self.reader = self.sock.makefile('rb')
+        self.sock.sendall(json.dumps(dict(body or {}, path=path)).encode('utf-8') + b'\n')
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionResetError('CIViC service closed the connection')
+        body = json.loads(line)
+        return body.pop('status'), body
+
+    def close(self):
+        if self.sock is not None:
+            self.reader.close()
+            self.sock.close()
+            self.sock = None
+
+
+class ServiceClient:
+    def __init__(self, url, timeout=30):
+        if url.startswith('unix://'):
+            self.transport = UnixTransport(url[len('unix://'):], timeout)
+        else:
+            self.transport = HTTPTransport(url.replace('http://', '').rstrip('/'), timeout)
+
+    def request(self, path, body=None):
+        # Reconnect once if the service closed an idle connection or was restarted
+        for attempt in range(2):
+            try:
+                status, answer = self.transport.send(path, body)
+                break
+            except (ConnectionError, http.client.HTTPException):
+                self.transport.close()
+                if attempt:
+                    raise
+        if status != 200:
+            raise RuntimeError(f'CIViC service error on {path}: {answer.get("error")}')
+        return answer
+
+    def lookup(self, name, keys, assembly='hg38'):
+        return self.request(f'/lookup/{name}', {'keys': keys, 'assembly': assembly})['results']
+
+    def compound(self):
+        return self.request('/compound')['results']
+
+    def status(self):
+        return self.request('/status')
+
+
+def connect(logger):
+    """A client for CIVIC_SERVICE_URL, or None when it is unset or the service is not answering"""
+    if not SERVICE_URL:
+        return None
+    client = ServiceClient(SERVICE_URL)
+    # Check in setup rather than on the first input line, and fall back to the local database
+    try:
+        client.status()
+    except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+        logger.warning(f'CIViC service at {SERVICE_URL} is not available, using the local database: {e}')
+        return None
+    return client
@@ -1,7 +1,13 @@
 import sys
 from cravat import BaseAnnotator
+from profiling import profiled
+import service_client
 
+@profiled('civic_gene', 'setup', 'annotate', 'cleanup')
 class CravatAnnotator(BaseAnnotator):
+    def setup(self):
+        self.service = service_client.connect(self.logger)
+
     def format_data(self, data_row):
         out = {
             'id': data_row[0],
@@ -13,6 +19,8 @@ class CravatAnnotator(BaseAnnotator):
 
     def annotate(self, input_data, secondary_data=None):
         hugo = input_data['hugo']
+        if self.service is not None:
+            return self.service.lookup('civic_gene', [hugo])[0]
         name_query = 'SELECT id, name, description, aliases FROM civic_gene WHERE name == ?'
         name_params = (hugo,)
         self.cursor.execute(name_query, name_params)
@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import csv
+import os
+import re
+import sys
+from datetime import datetime
+
+import requests
+
+from get_profile import fetch_molecular_profile, make_session, save_profile
+from profile_store import ProfileStore
+
+base_download_url = 'https://civicdb.org/downloads'
+OPERATOR = re.compile(r'(\(|\)|\bAND\b|\bOR\b|\bNOT\b)')
+
+csv.field_size_limit(sys.maxsize)
+
+
+def get_monthly_file_url(file_name, date=None):
+    """Get the file url for a monthly snapshot. e.g. '01-Mar-2023-MolecularProfileSummaries.tsv'"""
+    first = (date or datetime.now()).replace(day=1)
+    formatted = first.strftime('%d-%b-%Y')
+    return f'{base_download_url}/{formatted}/{formatted}-{file_name}.tsv'
+
+
+def iter_tsv(session, location):
+    """Stream rows of a local or remote TSV as dicts"""
+    if os.path.exists(location):
+        with open(location, newline='') as f:
+            yield from csv.DictReader(f, delimiter='\t')
+    else:
+        with session.get(location, timeout=120, stream=True) as response:
+            response.raise_for_status()
+            response.encoding = response.encoding or 'utf-8'
+            yield from csv.DictReader(response.iter_lines(decode_unicode=True), delimiter='\t')
+
+
+def parse_profile(row, variants):
+    """Rebuild the GraphQL parsedName of a profile from its summary row, or return None if the name is ambiguous.
+
+    The name is split on the boolean operators; every remaining operand has to be
+    exactly '<gene> <variant>' of one of the profile's own variant ids.
+    """
+    variant_ids = [int(variant_id) for variant_id in row['variant_ids'].split(',') if variant_id.strip()]
+    by_name = {}
+    for variant_id in variant_ids:
+        if variant_id not in variants:
+            return None
+        gene, name = variants[variant_id]
+        by_name.setdefault(f'{gene} {name}', []).append(variant_id)
+
+    parsed_name = []
+    used = set()
+    for part in OPERATOR.split(row['name']):
+        part = part.strip()
+        if not part:
+            continue
+        if OPERATOR.fullmatch(part):
+            parsed_name.append({'__typename': 'MolecularProfileTextSegment', 'text': part})
+            continue
+        candidates = by_name.get(part, [])
+        if len(candidates) != 1:
+            return None
+        variant_id = candidates[0]
+        gene, name = variants[variant_id]
+        parsed_name.append({'__typename': 'Gene', 'name': gene})
+        parsed_name.append({'__typename': 'Variant', 'id': variant_id, 'name': name, 'link': f'/variants/{variant_id}'})
+        used.add(variant_id)
+    if used != set(variant_ids):
+        return None
+    return {'data': {'molecularProfile': {'parsedName': parsed_name}}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Derive molecular profile structure from the monthly CIViC summaries, '
+                                                 'falling back to GraphQL for names that cannot be parsed')
+    parser.add_argument('--profiles-tsv', help='MolecularProfileSummaries.tsv path or url (default: current monthly release)')
+    parser.add_argument('--variants-tsv', help='VariantSummaries.tsv path or url (default: current monthly release)')
+    parser.add_argument('--store', help='Write profiles to this profile_store.py file')
+    parser.add_argument('--out-dir', default='variants', help='Directory for the per-profile JSON files when --store is not given')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        session = stack.enter_context(make_session(4))
+        if args.store:
+            store = stack.enter_context(ProfileStore(args.store))
+        else:
+            os.makedirs(args.out_dir, exist_ok=True)
+        variants = {
+            int(row['variant_id']): (row['gene'], row['variant'])
+            for row in iter_tsv(session, args.variants_tsv or get_monthly_file_url('VariantSummaries'))
+        }
+
+        parsed = fetched = failed = 0
+        for row in iter_tsv(session, args.profiles_tsv or get_monthly_file_url('MolecularProfileSummaries')):
+            molecular_profile_id = row['molecular_profile_id']
+            result = parse_profile(row, variants)
+            if result is None:
+                try:
+                    result = fetch_molecular_profile(int(molecular_profile_id), session)
+                except requests.RequestException as e:
+                    failed += 1
+                    print(f'Failed to fetch molecular profile {molecular_profile_id}: {e}', file=sys.stderr)
+                    continue
+                fetched += 1
+            else:
+                parsed += 1
+            result['molecular_profile_id'] = molecular_profile_id
+            if args.store:
+                store.put(molecular_profile_id, result)
+            else:
+                save_profile(result, args.out_dir)
+    print(f'{parsed} profiles parsed from the snapshot, {fetched} fetched with GraphQL, {failed} failed', file=sys.stderr)
@@ -0,0 +1,167 @@
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+STATE_PATH = '.pipeline_state.json'
+
+
+class Stage:
+    """One script in the data-prep chain with the files it reads and writes"""
+
+    def __init__(self, name, command, inputs, outputs, stdin=None, stdout=None, clean=False, always=False):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.stdin = stdin
+        self.stdout = stdout
+        # remove the outputs first, for scripts that add to an existing output instead of replacing it
+        self.clean = clean
+        # run on every refresh, for cheap checks of data outside the working directory;
+        # stages downstream are still skipped when the fresh output is unchanged
+        self.always = always
+
+    def run(self):
+        if self.clean:
+            for output in self.outputs:
+                if os.path.isfile(output):
+                    os.remove(output)
+        stdin = open(self.stdin) if self.stdin else None
+        # stdout goes to a temporary file, so a failed stage never leaves a partial output behind
+        stdout = open(self.stdout + '.tmp', 'w') if self.stdout else None
+        try:
+            result = subprocess.run([sys.executable, *self.command], stdin=stdin, stdout=stdout)
+        finally:
+            for f in (stdin, stdout):
+                if f:
+                    f.close()
+        if result.returncode != 0:
+            raise RuntimeError(f'{self.name} exited with status {result.returncode}')
+        if self.stdout:
+            os.replace(self.stdout + '.tmp', self.stdout)
+
+
+STAGES = [
+    # The scripts reading CIViC through civicpy load the whole database, so they are keyed on the snapshot's fingerprint
+    Stage('upstream', ['upstream_fingerprint.py'], inputs=['upstream_fingerprint.py'], outputs=['upstream_manifest.json'],
+          always=True),
+    Stage('ids', ['get_ids.py'], inputs=['get_ids.py', 'upstream_manifest.json'], outputs=['molecular_ids.csv'],
+          stdout='molecular_ids.csv'),
+    Stage('profiles', ['get_profile.py'], inputs=['get_profile.py', 'molecular_ids.csv'], outputs=['variants'],
+          stdin='molecular_ids.csv'),
+    Stage('booleans', ['mergefiles.py'], inputs=['mergefiles.py', 'variants'], outputs=['profile_booleans.json'],
+          stdout='profile_booleans.json'),
+    Stage('annot', ['get-civicpy-data.py'], inputs=['get-civicpy-data.py', 'upstream_manifest.json'], outputs=['annot.json'],
+          stdout='annot.json'),
+    Stage('variants_db', ['create_sqlite3.py'], inputs=['create_sqlite3.py', 'annot.json'], outputs=['variants.db'],
+          stdin='annot.json', clean=True),
+    Stage('parquet', ['export_parquet.py'],
+          inputs=['export_parquet.py', 'variants.db', 'new-annotators/civic/data/civic.sqlite',
+                  'new-annotators/civic_gene/data/civic_gene.sqlite'],
+          outputs=['parquet']),
+]
+
+
+def hash_inputs(paths):
+    """Content hash over files and, for directories, every file below them in sorted order"""
+    sha = hashlib.sha256()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for filepath in files:
+            sha.update(filepath.encode('utf-8') + b'\0')
+            if os.path.exists(filepath):
+                with open(filepath, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        sha.update(chunk)
+    return sha.hexdigest()
+
+
+def load_state():
+    try:
+        with open(STATE_PATH) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_state(state):
+    with open(STATE_PATH + '.tmp', 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(STATE_PATH + '.tmp', STATE_PATH)
+
+
+def run_pipeline(stages, force=(), workers=4):
+    """Run stages in dependency order, independent branches in parallel, skipping unchanged ones.
+
+    A stage depends on every stage that writes one of its inputs. It is skipped when
+    the hash of its inputs matches the last successful run and its outputs exist, unless
+    it is marked to always run.
+    """
+    producers = {output: stage.name for stage in stages for output in stage.outputs}
+    depends = {stage.name: {producers[i] for i in stage.inputs if i in producers} for stage in stages}
+    by_name = {stage.name: stage for stage in stages}
+    state = load_state()
+    summary = {}
+
+    def execute(stage):
+        start = time.time()
+        input_hash = hash_inputs(stage.inputs)
+        up_to_date = state.get(stage.name) == input_hash and all(map(os.path.exists, stage.outputs))
+        if up_to_date and stage.name not in force and not stage.always:
+            return 'skipped', input_hash, time.time() - start
+        stage.run()
+        return 'ran', input_hash, time.time() - start
+
+    pending = dict(depends)
+    running = {}
+    with ThreadPoolExecutor(workers) as pool:
+        while pending or running:
+            for name, deps in list(pending.items()):
+                if any(summary.get(dep, ('',))[0] == 'failed' for dep in deps):
+                    summary[name] = ('failed', 0.0, 'upstream stage failed')
+                    del pending[name]
+                elif all(dep in summary for dep in deps):
+                    running[pool.submit(execute, by_name[name])] = name
+                    del pending[name]
+            if not running:
+                if pending:
+                    raise ValueError(f'Stages {sorted(pending)} depend on each other')
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    status, input_hash, seconds = future.result()
+                except Exception as e:
+                    summary[name] = ('failed', 0.0, str(e))
+                    continue
+                summary[name] = (status, seconds, '')
+                state[name] = input_hash
+                save_state(state)
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the CIViC data-prep scripts, skipping stages whose inputs are unchanged')
+    parser.add_argument('stages', nargs='*', help='Only run these stages (default: all)')
+    parser.add_argument('--force', nargs='*', default=[], help='Re-run these stages even if their inputs are unchanged')
+    parser.add_argument('--workers', type=int, default=4, help='Stages run at the same time')
+    args = parser.parse_args()
+
+    stages = [stage for stage in STAGES if not args.stages or stage.name in args.stages]
+    total_start = time.time()
+    summary = run_pipeline(stages, force=set(args.force), workers=args.workers)
+    print(f'{"stage":<12} {"status":<8} {"seconds":>8}')
+    for stage in stages:
+        status, seconds, error = summary[stage.name]
+        print(f'{stage.name:<12} {status:<8} {seconds:>8.2f} {error}'.rstrip())
+    print(f'{"total":<12} {"":<8} {time.time() - total_start:>8.2f}')
+    if any(status == 'failed' for status, _, _ in summary.values()):
+        sys.exit(1)
@@ -3,83 +3,53 @@ import csv
 import json
 import sys
 from pyliftover import LiftOver
-import sqlite3
 import logging
 from datetime import datetime
 import time
 import os
 
-
-# Database Helper
-class CivicDB:
-    """Utility for interacting with CIVIC Databases"""
-    _insert_variant_sql = '''INSERT INTO civic(
-            id,
-            chromosome,
-            start,
-            reference_build,
-            reference_base,
-            variant_base,
-            description,
-            molecular_profile_score,
-            diseases
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
-    _logger = logging.getLogger('CivicDB')
-
-    def __init__(self, path):
-        self.path = path
-
-    def __enter__(self):
-        self._logger.info(f'Connecting to SQLite DB at {repr(self.path)}')
-        self.db = sqlite3.connect(self.path)
-        self.cursor = self.db.cursor()
-        return self
-
-    def __exit__(self, type, value, traceback):
-        self.db.commit()
-        self.cursor.close()
-        self.db.close()
-
-    def create_variant_table(self):
-        self.cursor.execute('DROP TABLE IF EXISTS civic;')
-        self.cursor.execute('''CREATE TABLE civic (
-            id INT,
-            chromosome TEXT,
-            start TEXT,
-            reference_base TEXT,
-            reference_build TEXT,
-            variant_base TEXT,
-            description TEXT,
-            molecular_profile_score REAL,
-            diseases TEXT
-        )''')
-
-    def insert_variant(self, data):
-        self.cursor.execute(self._insert_variant_sql, data)
-
-    def create_index(self):
-        self.cursor.execute('CREATE INDEX civic_index ON civic (start, reference_base, variant_base)')
+from profiling import profiled
+from civic_db import CivicDB
 
 
+@profiled('build_civic', 'main')
 class CivicBuilder:
     # Constants
     logger = logging.getLogger('build_civic')
-    lifter = LiftOver('hg19', 'hg38')
+    lifters = {'hg19': LiftOver('hg19', 'hg38'), 'hg38': LiftOver('hg38', 'hg19')}
+    builds = {'GRCH37': 'hg19', 'hg19': 'hg19', 'GRCH38': 'hg38', 'hg38': 'hg38'}
     base_download_url = 'https://civicdb.org/downloads'
     graphql_url = 'https://civicdb.org/api/graphql'
-    variant_query = """query variant($id: Int!) {
-      variant(id: $id) {
-        singleVariantMolecularProfile {
-          description
-          molecularProfileScore
-          evidenceItems {
+    # evidenceItems is a paged connection, so heavily curated variants need more than one request
+    evidence_page_size = 100
+    evidence_fields = """
+            pageInfo {
+              endCursor
+              hasNextPage
+            }
             nodes {
+              id
+              status
+              evidenceLevel
+              evidenceType
+              evidenceDirection
+              significance
               disease {
                 name
                 id
               }
+              therapies {
+                name
+              }
             }
-          }
+    """
+    variant_query = """query variant($id: Int!, $evidenceFirst: Int) {
+      variant(id: $id) {
+        singleVariantMolecularProfile {
+          id
+          description
+          molecularProfileScore
+          evidenceItems(first: $evidenceFirst) {%s}
         }
         id
         link
@@ -95,9 +65,16 @@ class CivicBuilder:
         }
       }
     }
-    """
+    """ % evidence_fields
+    evidence_query = """query molecularProfileEvidence($id: Int!, $first: Int, $after: String) {
+      molecularProfile(id: $id) {
+        evidenceItems(first: $first, after: $after) {%s}
+      }
+    }
+    """ % evidence_fields
 
     def __init__(self):
+        self.gene_idx = None
         self.logger.setLevel(logging.INFO)
         console_handler = logging.StreamHandler(sys.stdout)
         console_handler.setLevel(logging.INFO)
@@ -127,18 +104,58 @@ class CivicBuilder:
         return ", ".join(ordered)
 
     def normalize_position(self, reference_build: str, chrom: str, start_pos: str) -> tuple | None:
-        """Convert from hg19 to hg38"""
-        # only translate hg19, otherwise fail
-        if reference_build != 'GRCH37' and reference_build != 'hg19':
-            return None, None, None
-        start_coords = self.lifter.convert_coordinate(f'chr{chrom}', start_pos)
-        ref = 'hg38'
+        """Coordinates on both assemblies, as (build, hg38 chromosome, hg38 start, hg19 chromosome, hg19 start)"""
+        # only GRCh37 and GRCh38 are curated with coordinates we can use, otherwise fail
+        build = self.builds.get(reference_build)
+        if build is None:
+            return None, None, None, None, None
+        chromosome = f'chr{chrom}'
+        start_coords = self.lifters[build].convert_coordinate(chromosome, start_pos)
         if start_coords is not None and len(start_coords) > 0:
-            start = start_coords[0][1]
-            chromosome = start_coords[0][0]
+            lifted = (start_coords[0][0], start_coords[0][1])
         else:
-            return None, None, None
-        return ref, chromosome, start
+            # keep the variant for jobs on the assembly it was curated on
+            self.logger.warning(f'Could not lift {chromosome}:{start_pos} from {build}')
+            lifted = (None, None)
+        if build == 'hg38':
+            return (build, chromosome, start_pos) + lifted
+        return (build,) + lifted + (chromosome, start_pos)
+
+    def fetch_remaining_evidence(self, session, variant_json: dict):
+        """Follow the profile's evidenceItems connection past its first page, adding every item to variant_json"""
+        profile = self.deep_get(variant_json, 'data', 'variant', 'singleVariantMolecularProfile')
+        evidence = self.deep_get(profile, 'evidenceItems')
+        while self.deep_get(evidence, 'pageInfo', 'hasNextPage'):
+            response = session.post(self.graphql_url, json={
+                'query': self.evidence_query,
+                'variables': {'id': profile['id'], 'first': self.evidence_page_size, 'after': evidence['pageInfo']['endCursor']},
+            }, timeout=30)
+            response.raise_for_status()
+            page = self.deep_get(response.json(), 'data', 'molecularProfile', 'evidenceItems')
+            if page is None:
+                # Stopping here would store counts and diseases for part of the evidence only
+                raise ValueError(f'No evidence page for molecular profile {profile["id"]}: {response.text[:200]}')
+            evidence['nodes'].extend(page['nodes'])
+            evidence['pageInfo'] = page['pageInfo']
+
+    def get_evidence_items(self, variant_id: str, variant_json: dict) -> list:
+        """One civic_evidence row per evidence item of the variant's single-variant molecular profile"""
+        evidence = self.deep_get(variant_json, 'data', 'variant', 'singleVariantMolecularProfile', 'evidenceItems', 'nodes')
+        rows = []
+        for item in evidence or []:
+            therapies = sorted(therapy['name'] for therapy in item.get('therapies') or [])
+            rows.append((
+                item.get('id'),
+                variant_id,
+                (item.get('status') or '').lower() or None,
+                item.get('evidenceLevel'),
+                item.get('evidenceType'),
+                item.get('evidenceDirection'),
+                item.get('significance'),
+                self.deep_get(item, 'disease', 'name'),
+                ','.join(therapies),
+            ))
+        return rows
 
     def get_variant_data(self, variant_snapshot: list, variant_json: dict) -> tuple | None:
         """Extract data from a single variant from the monthly snapshot and data from the graphql query"""
@@ -161,12 +178,11 @@ class CivicBuilder:
             variant_base = '-'
 
         reference_build = self.deep_get(variant_json, 'data', 'variant', 'referenceBuild')
-        # Convert old coordinates to hg38
-        if reference_build != 'GRCH38' or reference_build != 'hg38':
-            reference_build, chromosome, start = self.normalize_position(
-                reference_build=reference_build,
-                chrom=chromosome,
-                start_pos=start)
+        # Store the variant under both assemblies, lifting over from the one it was curated on
+        reference_build, chromosome, start, chromosome_grch37, start_grch37 = self.normalize_position(
+            reference_build=reference_build,
+            chrom=chromosome,
+            start_pos=start)
         if reference_build is None:
             return None
 
@@ -181,7 +197,10 @@ class CivicBuilder:
             variant_base,
             description,
             mps,
-            self.get_diseases(evidence)
+            self.get_diseases(evidence),
+            chromosome_grch37,
+            start_grch37,
+            variant_snapshot[self.gene_idx] if self.gene_idx is not None else None
         )
 
     def get_current_month_variant_file_url(self):
@@ -208,22 +227,30 @@ class CivicBuilder:
             for i, column_name in enumerate(lines[0]):
                 if column_name == 'variant_id':
                     id_idx = i
+                # the gene column was renamed when CIViC generalized genes to features
+                elif column_name in ('gene', 'feature_name'):
+                    self.gene_idx = i
 
             for variant in lines[1:]:
                 v_id = variant[id_idx]
                 variant_gql = {
                     'query': self.variant_query,
                     'operation_name': f'variant_{v_id}',
-                    'variables': f'{{ "id": {v_id} }}'
+                    'variables': f'{{ "id": {v_id}, "evidenceFirst": {self.evidence_page_size} }}'
                 }
                 v_file = s.post(self.graphql_url, json=variant_gql, timeout=30)
                 v_json = json.loads(v_file.text)
+                self.fetch_remaining_evidence(s, v_json)
                 variant_data = self.get_variant_data(variant_snapshot=variant, variant_json=v_json)
                 if variant_data is not None:
                     self.logger.info(repr(variant_data))
                     total += 1
                     db.insert_variant(variant_data)
+                    db.insert_evidence(self.get_evidence_items(variant_data[0], v_json))
+            db.rank_scores()
+            db.aggregate_evidence()
             db.create_index()
+            db.create_search_index()
 
         stop_time = time.time()
         self.logger.info("Finished: %s" % time.asctime(time.localtime(stop_time)))
@@ -0,0 +1,161 @@
+"""The civic.sqlite schema and writes, kept apart from build_civic.py so the benchmarks can build the same database"""
+import logging
+import sqlite3
+
+
+class CivicDB:
+    """Utility for interacting with CIVIC Databases"""
+    _insert_variant_sql = '''INSERT INTO civic(
+            id,
+            chromosome,
+            start,
+            reference_build,
+            reference_base,
+            variant_base,
+            description,
+            molecular_profile_score,
+            diseases,
+            chromosome_grch37,
+            start_grch37,
+            gene
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    _insert_evidence_sql = '''INSERT INTO civic_evidence(
+            id,
+            variant_id,
+            status,
+            level,
+            type,
+            direction,
+            significance,
+            disease,
+            therapies
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+    # civic columns holding the count of a variant's evidence items of each type
+    evidence_type_columns = {
+        'PREDICTIVE': 'num_predictive_eids',
+        'DIAGNOSTIC': 'num_diagnostic_eids',
+        'PROGNOSTIC': 'num_prognostic_eids',
+        'PREDISPOSING': 'num_predisposing_eids',
+        'ONCOGENIC': 'num_oncogenic_eids',
+        'FUNCTIONAL': 'num_functional_eids',
+    }
+    _logger = logging.getLogger('CivicDB')
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._logger.info(f'Connecting to SQLite DB at {repr(self.path)}')
+        self.db = sqlite3.connect(self.path)
+        self.cursor = self.db.cursor()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.db.commit()
+        self.cursor.close()
+        self.db.close()
+
+    def create_variant_table(self):
+        # chromosome and start are GRCh38; chromosome_grch37 and start_grch37 hold the same variant on GRCh37.
+        # reference_build is the assembly CIViC curated the variant on, the other one is lifted over.
+        self.cursor.execute('DROP TABLE IF EXISTS civic;')
+        self.cursor.execute('DROP TABLE IF EXISTS civic_search;')
+        self.cursor.execute('DROP TABLE IF EXISTS civic_diseases;')
+        self.cursor.execute('DROP TABLE IF EXISTS civic_evidence;')
+        self.cursor.execute('''CREATE TABLE civic (
+            id INT,
+            chromosome TEXT,
+            start TEXT,
+            reference_base TEXT,
+            reference_build TEXT,
+            variant_base TEXT,
+            description TEXT,
+            molecular_profile_score REAL,
+            diseases TEXT,
+            chromosome_grch37 TEXT,
+            start_grch37 INTEGER,
+            gene TEXT,
+            score_percentile REAL,
+            max_evidence_level TEXT,
+            num_eids INT,
+            num_predictive_eids INT,
+            num_diagnostic_eids INT,
+            num_prognostic_eids INT,
+            num_predisposing_eids INT,
+            num_oncogenic_eids INT,
+            num_functional_eids INT
+        )''')
+        # One row per variant and disease, with the score copied in, so top-K per disease is an index range scan
+        self.cursor.execute('''CREATE TABLE civic_diseases (
+            id INT,
+            disease TEXT,
+            molecular_profile_score REAL
+        )''')
+        self.cursor.execute('''CREATE TABLE civic_evidence (
+            id INT,
+            variant_id INT,
+            status TEXT,
+            level TEXT,
+            type TEXT,
+            direction TEXT,
+            significance TEXT,
+            disease TEXT,
+            therapies TEXT
+        )''')
+
+    def insert_variant(self, data):
+        self.cursor.execute(self._insert_variant_sql, data)
+
+    def insert_variants(self, rows):
+        self.cursor.executemany(self._insert_variant_sql, rows)
+
+    def insert_evidence(self, rows):
+        self.cursor.executemany(self._insert_evidence_sql, rows)
+
+    def create_index(self):
+        self.cursor.execute('CREATE INDEX civic_index ON civic (start, reference_base, variant_base)')
+        self.cursor.execute('CREATE INDEX civic_grch37_index ON civic (start_grch37, reference_base, variant_base)')
+        self.cursor.execute('CREATE INDEX civic_score_index ON civic (molecular_profile_score)')
+        self.cursor.execute('CREATE INDEX civic_gene_score_index ON civic (gene, molecular_profile_score)')
+        self.cursor.execute('CREATE INDEX civic_diseases_score_index ON civic_diseases (disease, molecular_profile_score)')
+        self.cursor.execute('CREATE INDEX civic_evidence_variant_index ON civic_evidence (variant_id)')
+
+    def rank_scores(self):
+        """Fill score_percentile (0-100, ties share a rank) and the per-disease scores once all variants are in"""
+        self.cursor.execute('''UPDATE civic SET score_percentile = ranked.percentile
+            FROM (
+                SELECT rowid, 100.0 * percent_rank() OVER (ORDER BY molecular_profile_score) AS percentile
+                FROM civic WHERE molecular_profile_score IS NOT NULL
+            ) AS ranked
+            WHERE ranked.rowid = civic.rowid''')
+        rows = self.cursor.execute('SELECT id, diseases, molecular_profile_score FROM civic').fetchall()
+        self.cursor.executemany('INSERT INTO civic_diseases (id, disease, molecular_profile_score) VALUES (?, ?, ?)', [
+            (civic_id, disease, score)
+            for civic_id, diseases, score in rows
+            for disease in (diseases or '').split(', ') if disease
+        ])
+
+    def aggregate_evidence(self):
+        """Summarize each variant's accepted and submitted evidence on its civic row, so the annotator reads it with the variant"""
+        # Levels run from A (validated) to E (inferential), so the best level is the smallest
+        counts = ', '.join(f"SUM(type = '{ev_type}') AS {column}" for ev_type, column in self.evidence_type_columns.items())
+        columns = ', '.join(f'{column} = summary.{column}' for column in self.evidence_type_columns.values())
+        self.cursor.execute(f'''UPDATE civic SET max_evidence_level = summary.max_evidence_level, num_eids = summary.num_eids, {columns}
+            FROM (
+                SELECT variant_id, MIN(level) AS max_evidence_level, COUNT(*) AS num_eids, {counts}
+                FROM civic_evidence
+                WHERE status IN ('accepted', 'submitted')
+                GROUP BY variant_id
+            ) AS summary
+            WHERE summary.variant_id = civic.id''')
+        # Variants without any evidence have zero counts rather than none
+        zeros = ', '.join(f'{column} = 0' for column in self.evidence_type_columns.values())
+        self.cursor.execute(f'UPDATE civic SET num_eids = 0, {zeros} WHERE num_eids IS NULL')
+
+    def create_search_index(self):
+        # Full-text index for search_civic.py. It reads the text from civic instead of storing a copy, so it is
+        # filled in one pass once all rows are in.
+        self.cursor.execute('''CREATE VIRTUAL TABLE civic_search USING fts5(
+            description, diseases, content='civic', tokenize='porter unicode61 remove_diacritics 2'
+        )''')
+        self.cursor.execute("INSERT INTO civic_search(civic_search) VALUES ('rebuild')")
@@ -3,54 +3,16 @@ import json
 import requests
 import csv
 import sys
-import sqlite3
 import logging
 from datetime import datetime
 import time
 import os
 
-
-# Database Helper
-class CivicDB:
-    """Utility for interacting with CIVIC Databases"""
-    _insert_gene_sql = '''INSERT INTO civic_gene(
-            id,
-            name,
-            description,
-            aliases
-        ) VALUES (?, ?, ?, ?)'''
-    _logger = logging.getLogger('CivicDB')
-
-    def __init__(self, path):
-        self.path = path
-
-    def __enter__(self):
-        self._logger.info(f'Connecting to SQLite DB at {repr(self.path)}')
-        self.db = sqlite3.connect(self.path)
-        self.cursor = self.db.cursor()
-        return self
-
-    def __exit__(self, type, value, traceback):
-        self.db.commit()
-        self.cursor.close()
-        self.db.close()
-
-    def create_variant_table(self):
-        self.cursor.execute('DROP TABLE IF EXISTS civic_gene;')
-        self.cursor.execute('''CREATE TABLE civic_gene (
-            id INT,
-            name TEXT,
-            description TEXT,
-            aliases TEXT
-        )''')
-
-    def insert_gene(self, data):
-        self.cursor.execute(self._insert_gene_sql, data)
-
-    def create_index(self):
-        self.cursor.execute('CREATE INDEX civic_gene_index ON civic_gene (name)')
+from profiling import profiled
+from civic_gene_db import CivicDB
 
 
+@profiled('build_civic_gene', 'main')
 class CivicBuilder:
     # Constants
     logger = logging.getLogger('build_civic')
@@ -65,6 +27,20 @@ class CivicBuilder:
           }
         }
     """
+    genes_query = """query genes($first: Int, $after: String) {
+        genes(first: $first, after: $after) {
+            pageInfo {
+                endCursor
+                hasNextPage
+            }
+            nodes {
+                id,
+                geneAliases
+            }
+          }
+        }
+    """
+    gene_page_size = 500
 
     def __init__(self):
         self.description_idx = 0
@@ -91,12 +67,45 @@ class CivicBuilder:
         return f'{self.base_download_url}/{formatted}/{formatted}-{file_name}.tsv'
 
 
-    def get_gene_data(self, gene_snapshot: list, gene_json: dict) -> tuple:
-        """Extract data for a single variant from the snapshot and api results"""
+    def get_all_gene_aliases(self, session) -> dict:
+        """Page through the genes connection and map every gene id to its alias list"""
+        aliases = {}
+        cursor = None
+        pages = 0
+        while True:
+            genes_gql = {
+                'query': self.genes_query,
+                'operation_name': f'genes_{pages}',
+                'variables': {'first': self.gene_page_size, 'after': cursor}
+            }
+            g_file = session.post(self.graphql_url, json=genes_gql, timeout=120)
+            g_json = json.loads(g_file.text)
+            connection = g_json['data']['genes']
+            for node in connection['nodes']:
+                aliases[str(node['id'])] = node['geneAliases']
+            pages += 1
+            if not connection['pageInfo']['hasNextPage']:
+                break
+            cursor = connection['pageInfo']['endCursor']
+        self.logger.info(f'Fetched aliases for {len(aliases)} genes in {pages} requests')
+        return aliases
+
+    def get_gene_aliases(self, session, gene_id: str) -> list:
+        """Fetch the aliases of a single gene, for genes missing from the bulk fetch"""
+        gene_gql = {
+            'query': self.gene_query,
+            'operation_name': f'gene_{gene_id}',
+            'variables': f'{{ "id": {gene_id} }}'
+        }
+        g_file = session.post(self.graphql_url, json=gene_gql, timeout=30)
+        g_json = json.loads(g_file.text)
+        return g_json['data']['gene']['geneAliases']
+
+    def get_gene_data(self, gene_snapshot: list, alias_list: list) -> tuple:
+        """Extract data for a single gene from the snapshot and api results"""
         gene_id = gene_snapshot[self.id_idx]
         name = gene_snapshot[self.name_idx]
         description = gene_snapshot[self.description_idx]
-        alias_list = gene_json['data']['gene']['geneAliases']
         aliases = ",".join(alias_list)
         return gene_id, name, description, aliases
 
@@ -122,20 +131,20 @@ class CivicBuilder:
                 elif column_name == 'description':
                     self.description_idx = i
 
+            all_aliases = self.get_all_gene_aliases(s)
+            rows = []
             for gene in lines[1:]:
                 gene_id = gene[self.id_idx]
-                gene_gql = {
-                    'query': self.gene_query,
-                    'operation_name': f'gene_{gene_id}',
-                    'variables': f'{{ "id": {gene_id} }}'
-                }
-                g_file = s.post(self.graphql_url, json=gene_gql, timeout=30)
-                g_json = json.loads(g_file.text)
-                gene_data = self.get_gene_data(gene_snapshot=gene, gene_json=g_json)
+                alias_list = all_aliases.get(gene_id)
+                if alias_list is None:
+                    alias_list = self.get_gene_aliases(s, gene_id)
+                gene_data = self.get_gene_data(gene_snapshot=gene, alias_list=alias_list)
                 self.logger.info(repr(gene_data))
-                total += 1
-                db.insert_gene(gene_data)
+                rows.append(gene_data)
+            db.insert_genes(rows)
+            total = len(rows)
             db.create_index()
+            db.create_search_index()
 
         stop_time = time.time()
         self.logger.info("Finished: %s" % time.asctime(time.localtime(stop_time)))
@@ -0,0 +1,54 @@
+"""The civic_gene.sqlite schema and writes, kept apart from build_civic_gene.py so the benchmarks can build the same database"""
+import logging
+import sqlite3
+
+
+class CivicDB:
+    """Utility for interacting with CIVIC Databases"""
+    _insert_gene_sql = '''INSERT INTO civic_gene(
+            id,
+            name,
+            description,
+            aliases
+        ) VALUES (?, ?, ?, ?)'''
+    _logger = logging.getLogger('CivicDB')
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self._logger.info(f'Connecting to SQLite DB at {repr(self.path)}')
+        self.db = sqlite3.connect(self.path)
+        self.cursor = self.db.cursor()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.db.commit()
+        self.cursor.close()
+        self.db.close()
+
+    def create_variant_table(self):
+        self.cursor.execute('DROP TABLE IF EXISTS civic_gene;')
+        self.cursor.execute('DROP TABLE IF EXISTS civic_gene_search;')
+        self.cursor.execute('''CREATE TABLE civic_gene (
+            id INT,
+            name TEXT,
+            description TEXT,
+            aliases TEXT
+        )''')
+
+    def insert_gene(self, data):
+        self.cursor.execute(self._insert_gene_sql, data)
+
+    def insert_genes(self, rows):
+        self.cursor.executemany(self._insert_gene_sql, rows)
+
+    def create_index(self):
+        self.cursor.execute('CREATE INDEX civic_gene_index ON civic_gene (name)')
+
+    def create_search_index(self):
+        # Names, summaries and aliases for search_civic.py, indexed in one pass after the genes are inserted
+        self.cursor.execute('''CREATE VIRTUAL TABLE civic_gene_search USING fts5(
+            name, description, aliases, content='civic_gene', tokenize='porter unicode61 remove_diacritics 2'
+        )''')
+        self.cursor.execute("INSERT INTO civic_gene_search(civic_gene_search) VALUES ('rebuild')")
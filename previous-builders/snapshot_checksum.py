@@ -0,0 +1,102 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+
+import requests
+
+base_download_url = 'https://civicdb.org/downloads'
+manifest_path = 'latest_manifest.json'
+# the snapshot url embeds the month, so it is left out of the comparison
+fingerprint_keys = ('etag', 'last_modified', 'sha256')
+
+
+def get_current_version_number():
+    now = datetime.now()
+    first = now.replace(day=1)
+    return first.strftime('%Y.%m.%d')
+
+
+def get_current_month_file_url(file_name):
+    """Get the file url for current monthly snapshot. e.g. '01-Mar-2023-VariantSummaries.tsv'"""
+    now = datetime.now()
+    first = now.replace(day=1)
+    formatted = first.strftime('%d-%b-%Y')
+    return f'{base_download_url}/{formatted}/{formatted}-{file_name}.tsv'
+
+
+def get_content_hash(session, url):
+    """Hash the snapshot body in chunks, for servers that send no ETag or Last-Modified"""
+    sha = hashlib.sha256()
+    with session.get(url, timeout=120, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=1 << 16):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def get_remote_fingerprint(session, url):
+    """Describe the current snapshot with a HEAD request, only downloading it when the headers are missing"""
+    response = session.head(url, timeout=30, allow_redirects=True)
+    response.raise_for_status()
+    fingerprint = {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'sha256': None,
+    }
+    if fingerprint['etag'] is None and fingerprint['last_modified'] is None:
+        fingerprint['sha256'] = get_content_hash(session, url)
+    return fingerprint
+
+
+def get_last_run_manifest():
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_updated_manifest(fingerprint):
+    manifest = dict(fingerprint, version=get_current_version_number())
+    with open(manifest_path, 'w+') as f:
+        json.dump(manifest, f, indent=4)
+
+
+def is_changed(manifest, fingerprint):
+    return any(manifest.get(key) != fingerprint[key] for key in fingerprint_keys)
+
+
+def get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def build(command, db_path):
+    """Run the builder and report whether it wrote a fresh database, not just whether an older one is still there"""
+    before = get_mtime(db_path)
+    if os.system(command) != 0:
+        return False
+    after = get_mtime(db_path)
+    return after is not None and (before is None or after > before)
+
+
+def run(file_name, label, command, db_path):
+    current_version = get_current_version_number()
+    with requests.Session() as s:
+        try:
+            fingerprint = get_remote_fingerprint(s, get_current_month_file_url(file_name))
+        except requests.RequestException as e:
+            print(f'{label} snapshot for {current_version} not available: {e}')
+            return
+
+    if not is_changed(get_last_run_manifest(), fingerprint):
+        print(f'{label} up to date with current month version: {current_version}')
+    elif build(command, db_path):
+        # only record the snapshot once a build from it has succeeded, so a failed build is retried on the next poll
+        write_updated_manifest(fingerprint)
+    else:
+        print('The database was not created')
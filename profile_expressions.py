@@ -0,0 +1,194 @@
+"""Compile molecular profile parsed names into a vectorized predicate table.
+
+Each profile's parsedName (Gene, Variant and text segments such as AND, OR,
+NOT and parentheses) is parsed once into an expression tree, rewritten into
+disjunctive normal form and flattened into integer arrays. Evaluating every
+profile against a set of observed variant ids is then a few NumPy passes.
+"""
+import argparse
+import json
+import re
+import sys
+
+import numpy as np
+
+TEXT_TOKEN = re.compile(r'\(|\)|\bAND\b|\bOR\b|\bNOT\b')
+
+
+def tokenize(parsed_name):
+    """Turn parsedName segments into ('VAR', variant_id) and operator tokens; gene labels are dropped"""
+    tokens = []
+    for segment in parsed_name:
+        if segment['__typename'] == 'Variant':
+            tokens.append(('VAR', segment['id']))
+        elif segment['__typename'] == 'MolecularProfileTextSegment':
+            text = segment['text']
+            found = TEXT_TOKEN.findall(text)
+            if TEXT_TOKEN.sub('', text).strip():
+                raise ValueError(f'Unrecognized token text: {text!r}')
+            tokens.extend((token, None) for token in found)
+    return tokens
+
+
+def parse(parsed_name):
+    """Parse a profile into a tree of ('var', id), ('not', x), ('and', [..]) and ('or', [..]).
+    NOT binds tightest, then AND, then OR."""
+    tokens = tokenize(parsed_name)
+    pos = 0
+
+    def peek():
+        return tokens[pos][0] if pos < len(tokens) else None
+
+    def take(expected):
+        nonlocal pos
+        if peek() != expected:
+            raise ValueError(f'Expected {expected} at token {pos}, found {peek()}')
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or():
+        terms = [parse_and()]
+        while peek() == 'OR':
+            take('OR')
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else ('or', terms)
+
+    def parse_and():
+        terms = [parse_not()]
+        while peek() == 'AND':
+            take('AND')
+            terms.append(parse_not())
+        return terms[0] if len(terms) == 1 else ('and', terms)
+
+    def parse_not():
+        if peek() == 'NOT':
+            take('NOT')
+            return ('not', parse_not())
+        if peek() == '(':
+            take('(')
+            tree = parse_or()
+            take(')')
+            return tree
+        return ('var', take('VAR')[1])
+
+    tree = parse_or()
+    if pos != len(tokens):
+        raise ValueError(f'Unexpected {peek()} at token {pos}')
+    return tree
+
+
+def to_dnf(tree, negate=False):
+    """Rewrite a tree as a list of clauses (required ids, forbidden ids), pushing NOT down to the variants"""
+    kind = tree[0]
+    if kind == 'var':
+        return [(frozenset(), frozenset([tree[1]]))] if negate else [(frozenset([tree[1]]), frozenset())]
+    if kind == 'not':
+        return to_dnf(tree[1], not negate)
+    # De Morgan: a negated AND is an OR of negations and vice versa
+    is_or = (kind == 'or') != negate
+    children = [to_dnf(child, negate) for child in tree[1]]
+    if is_or:
+        return [clause for child in children for clause in child]
+    clauses = [(frozenset(), frozenset())]
+    for child in children:
+        clauses = [(pos | child_pos, neg | child_neg) for pos, neg in clauses for child_pos, child_neg in child]
+    # A clause that both requires and forbids a variant can never hold
+    return [(pos, neg) for pos, neg in clauses if not pos & neg]
+
+
+class PredicateTable:
+    """Every profile's DNF clauses flattened into integer arrays.
+
+    clause_profile[c] is the profile row of clause c, clause_size[c] the number of
+    variants it requires. (pos_clause, pos_variant) and (neg_clause, neg_variant)
+    list the required and forbidden variants of each clause as column indexes.
+    """
+
+    def __init__(self, mp_ids, variant_ids, clause_profile, clause_size, pos_clause, pos_variant, neg_clause, neg_variant):
+        self.mp_ids = np.asarray(mp_ids, dtype=np.int64)
+        self.variant_ids = np.asarray(variant_ids, dtype=np.int64)
+        self.clause_profile = np.asarray(clause_profile, dtype=np.int32)
+        self.clause_size = np.asarray(clause_size, dtype=np.int32)
+        self.pos_clause = np.asarray(pos_clause, dtype=np.int32)
+        self.pos_variant = np.asarray(pos_variant, dtype=np.int32)
+        self.neg_clause = np.asarray(neg_clause, dtype=np.int32)
+        self.neg_variant = np.asarray(neg_variant, dtype=np.int32)
+        self.errors = {}
+
+    @classmethod
+    def compile(cls, profiles):
+        """Compile a profile_booleans.json style mapping of mp_id -> GraphQL response"""
+        mp_ids = []
+        columns = {}
+        clause_profile, clause_size = [], []
+        pos_clause, pos_variant, neg_clause, neg_variant = [], [], [], []
+        errors = {}
+        for mp_id, profile in profiles.items():
+            try:
+                clauses = to_dnf(parse(profile['data']['molecularProfile']['parsedName']))
+            except (ValueError, KeyError, TypeError) as e:
+                errors[int(mp_id)] = str(e)
+                continue
+            row = len(mp_ids)
+            mp_ids.append(int(mp_id))
+            for pos, neg in clauses:
+                clause = len(clause_profile)
+                clause_profile.append(row)
+                clause_size.append(len(pos))
+                for variant_id in pos:
+                    pos_clause.append(clause)
+                    pos_variant.append(columns.setdefault(variant_id, len(columns)))
+                for variant_id in neg:
+                    neg_clause.append(clause)
+                    neg_variant.append(columns.setdefault(variant_id, len(columns)))
+        table = cls(mp_ids, list(columns), clause_profile, clause_size, pos_clause, pos_variant, neg_clause, neg_variant)
+        table.errors = errors
+        return table
+
+    def save(self, path):
+        np.savez(path, **{name: getattr(self, name) for name in (
+            'mp_ids', 'variant_ids', 'clause_profile', 'clause_size',
+            'pos_clause', 'pos_variant', 'neg_clause', 'neg_variant')})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(**{name: arrays[name] for name in arrays.files})
+
+    def observed_mask(self, observed_variant_ids):
+        """Boolean vector over the table's variant columns"""
+        return np.isin(self.variant_ids, np.fromiter(observed_variant_ids, dtype=np.int64))
+
+    def evaluate(self, observed_variant_ids):
+        """Boolean vector over profiles: True where the profile holds for the observed variants"""
+        observed = self.observed_mask(observed_variant_ids)
+        clauses = len(self.clause_size)
+        present = np.bincount(self.pos_clause, weights=observed[self.pos_variant], minlength=clauses)
+        forbidden = np.bincount(self.neg_clause, weights=observed[self.neg_variant], minlength=clauses)
+        clause_holds = (present == self.clause_size) & (forbidden == 0)
+        return np.bincount(self.clause_profile, weights=clause_holds, minlength=len(self.mp_ids)) > 0
+
+    def satisfied(self, observed_variant_ids):
+        return self.mp_ids[self.evaluate(observed_variant_ids)].tolist()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Evaluate every molecular profile against a set of observed CIViC variant ids')
+    parser.add_argument('variant_ids', nargs='*', type=int, help='Observed variant ids')
+    parser.add_argument('--profiles', default='profile_booleans.json', help='Merged profiles from mergefiles.py')
+    parser.add_argument('--table', help='Compiled table (.npz) to load, or to write when --compile is given')
+    parser.add_argument('--compile', action='store_true', help='Compile --profiles and save the table to --table')
+    args = parser.parse_args()
+    if args.compile and not args.table:
+        parser.error('--compile needs --table to write to')
+
+    if args.table and not args.compile:
+        table = PredicateTable.load(args.table)
+    else:
+        with open(args.profiles) as f:
+            table = PredicateTable.compile(json.load(f))
+        for mp_id, error in table.errors.items():
+            print(f'Skipping molecular profile {mp_id}: {error}', file=sys.stderr)
+        if args.compile:
+            table.save(args.table)
+    print(json.dumps(table.satisfied(args.variant_ids)))
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections.abc import Mapping
+
+
+class ProfileStore:
+    """Single-file store of fetched molecular profiles, keyed by mp_id.
+
+    Replaces the one-JSON-file-per-profile layout of variants/. The database
+    runs in WAL mode with a busy timeout, so several fetchers can write to it
+    while readers keep a consistent view.
+    """
+
+    def __init__(self, path='profiles.sqlite'):
+        self.path = path
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS profiles (
+            mp_id INTEGER PRIMARY KEY,
+            fetched_at REAL NOT NULL,
+            body TEXT NOT NULL
+        )''')
+        self.db.commit()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.db.commit()
+        self.db.close()
+
+    def put(self, mp_id, profile, fetched_at=None):
+        self.db.execute(
+            'INSERT OR REPLACE INTO profiles (mp_id, fetched_at, body) VALUES (?, ?, ?)',
+            (int(mp_id), time.time() if fetched_at is None else fetched_at, json.dumps(profile)),
+        )
+        self.db.commit()
+
+    def get(self, mp_id):
+        row = self.db.execute('SELECT body FROM profiles WHERE mp_id = ?', (int(mp_id),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def fetched_at(self, mp_id):
+        row = self.db.execute('SELECT fetched_at FROM profiles WHERE mp_id = ?', (int(mp_id),)).fetchone()
+        return None if row is None else row[0]
+
+    def ids(self):
+        return [mp_id for mp_id, in self.db.execute('SELECT mp_id FROM profiles ORDER BY mp_id')]
+
+    def items(self):
+        """Yield (mp_id, profile) pairs one row at a time"""
+        for mp_id, body in self.db.execute('SELECT mp_id, body FROM profiles ORDER BY mp_id'):
+            yield mp_id, json.loads(body)
+
+    def booleans(self):
+        return ProfileBooleans(self)
+
+    def import_dir(self, directory):
+        """Load an existing variants/ directory, keeping each file's mtime as its fetch time"""
+        total = 0
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                filepath = os.path.join(directory, filename)
+                with open(filepath, 'r') as file:
+                    data = json.load(file)
+                self.db.execute(
+                    'INSERT OR REPLACE INTO profiles (mp_id, fetched_at, body) VALUES (?, ?, ?)',
+                    (int(data['molecular_profile_id']), os.path.getmtime(filepath), json.dumps(data)),
+                )
+                total += 1
+        self.db.commit()
+        return total
+
+
+class ProfileBooleans(Mapping):
+    """Read-only view of the store with the same shape as profile_booleans.json.
+
+    Keys are mp_id strings; each profile is read and parsed only when it is looked up.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, mp_id):
+        try:
+            profile = self.store.get(mp_id)
+        except (TypeError, ValueError, OverflowError):
+            # Not an mp_id at all, which for a Mapping is just a missing key
+            raise KeyError(mp_id) from None
+        if profile is None:
+            raise KeyError(mp_id)
+        return profile
+
+    def __iter__(self):
+        return (str(mp_id) for mp_id in self.store.ids())
+
+    def __len__(self):
+        return self.store.db.execute('SELECT COUNT(*) FROM profiles').fetchone()[0]
+
+    def items(self):
+        return ((str(mp_id), profile) for mp_id, profile in self.store.items())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the packed molecular profile store')
+    parser.add_argument('--store', default='profiles.sqlite', help='Store file')
+    parser.add_argument('--import-dir', help='Import the per-profile JSON files from this directory')
+    args = parser.parse_args()
+
+    with ProfileStore(args.store) as store:
+        if args.import_dir:
+            total = store.import_dir(args.import_dir)
+            print(f'Imported {total} profiles into {args.store}', file=sys.stderr)
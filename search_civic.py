@@ -0,0 +1,159 @@
+"""Ranked keyword search and top-K score queries over the CIViC databases.
+
+The builders index civic.description and civic.diseases, and civic_gene.name,
+description and aliases, in SQLite FTS5 tables that point at the rows of the
+main tables instead of copying their text. Queries use the FTS5 syntax, so
+"resistance AND osimertinib", "osimertin*", "NEAR(egfr resistance)" and
+"diseases: melanoma" all work, and words are matched by their Porter stem, so
+"resistance" also finds "resistant". Results are (id, score) pairs ranked by
+bm25, best first.
+
+    python search_civic.py "resistance AND osimertinib"
+    python search_civic.py --genes "kinase AND erbb"
+    python search_civic.py --index --civic-db path/to/civic.sqlite   # index a database built before the search tables
+
+The builders also index scores, so the highest scoring variants overall, for
+one gene or for one disease, and the highest scoring molecular profiles in
+variants.db, are read off an index in score order instead of sorted.
+
+    python search_civic.py --top --disease Melanoma --min-score 50
+    python search_civic.py --top --profiles --limit 5
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+CIVIC_DB = os.path.join('new-annotators', 'civic', 'data', 'civic.sqlite')
+CIVIC_GENE_DB = os.path.join('new-annotators', 'civic_gene', 'data', 'civic_gene.sqlite')
+VARIANTS_DB = 'variants.db'
+LIMIT = 20
+
+# table: (search table, indexed columns, bm25 weight of each column)
+SEARCH_TABLES = {
+    'civic': ('civic_search', ('description', 'diseases'), (1.0, 2.0)),
+    # A query naming a gene should rank that gene above the ones that only mention it
+    'civic_gene': ('civic_gene_search', ('name', 'description', 'aliases'), (10.0, 1.0, 5.0)),
+}
+
+
+def create_search_index(db, table):
+    """Create and fill the FTS5 table over an already loaded table, the way the builders do"""
+    search_table, columns, _ = SEARCH_TABLES[table]
+    db.execute(f'DROP TABLE IF EXISTS {search_table}')
+    db.execute(f'''CREATE VIRTUAL TABLE {search_table} USING fts5(
+        {", ".join(columns)}, content='{table}', tokenize='porter unicode61 remove_diacritics 2'
+    )''')
+    db.execute(f"INSERT INTO {search_table}({search_table}) VALUES ('rebuild')")
+
+
+def require_table(db, path, name):
+    if db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (name,)).fetchone() is None:
+        raise ValueError(f'{path} has no {name} table, rebuild it')
+
+
+def search(path, table, query, limit=LIMIT):
+    """Ids of the rows of table matching an FTS5 query, with their bm25 scores, best first"""
+    search_table, _, weights = SEARCH_TABLES[table]
+    with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as db:
+        if db.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (search_table,)).fetchone() is None:
+            raise ValueError(f'{path} has no {search_table} table, rebuild it or run search_civic.py --index')
+        try:
+            # bm25 scores are negative, lower is better
+            return [(row_id, -score) for row_id, score in db.execute(f'''
+                SELECT {table}.id, bm25({search_table}, {", ".join(map(str, weights))}) AS score
+                FROM {search_table} JOIN {table} ON {table}.rowid = {search_table}.rowid
+                WHERE {search_table} MATCH ?
+                ORDER BY score
+                LIMIT ?
+            ''', (query, limit))]
+        except sqlite3.OperationalError as e:
+            raise ValueError(f'Bad search {query!r}: {e}')
+
+
+def search_variants(query, path=CIVIC_DB, limit=LIMIT):
+    return search(path, 'civic', query, limit)
+
+
+def search_genes(query, path=CIVIC_GENE_DB, limit=LIMIT):
+    return search(path, 'civic_gene', query, limit)
+
+
+def top_scores(path, table, where, params, min_score, limit):
+    """(id, score) for the highest scores in table matching where, best first, walking the score index backwards"""
+    # Rows without a score are left out, as they would sort last anyway
+    where = where + ['molecular_profile_score >= ?' if min_score is not None else 'molecular_profile_score IS NOT NULL']
+    params = params + ([min_score] if min_score is not None else [])
+    id_column = 'mp_id' if table == 'profile_scores' else 'id'
+    with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as db:
+        require_table(db, path, table)
+        return db.execute(f'''
+            SELECT {id_column}, molecular_profile_score FROM {table}
+            WHERE {' AND '.join(where)}
+            ORDER BY molecular_profile_score DESC
+            LIMIT ?
+        ''', params + [limit]).fetchall()
+
+
+def top_variants(path=CIVIC_DB, gene=None, disease=None, min_score=None, limit=LIMIT):
+    """Highest scoring civic variant ids, for one gene or one disease if given"""
+    if gene is not None and disease is not None:
+        raise ValueError('Top variants are indexed by gene or by disease, not both')
+    if disease is not None:
+        return top_scores(path, 'civic_diseases', ['disease = ?'], [disease], min_score, limit)
+    if gene is not None:
+        with sqlite3.connect(f'file:{path}?mode=ro', uri=True) as db:
+            if 'gene' not in {row[1] for row in db.execute('PRAGMA table_info(civic)')}:
+                raise ValueError(f'{path} has no gene column, rebuild it')
+        return top_scores(path, 'civic', ['gene = ?'], [gene], min_score, limit)
+    return top_scores(path, 'civic', [], [], min_score, limit)
+
+
+def top_profiles(path=VARIANTS_DB, min_score=None, limit=LIMIT):
+    """Highest scoring molecular profile ids in a create_sqlite3.py database"""
+    return top_scores(path, 'profile_scores', [], [], min_score, limit)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search CIViC variant descriptions and diseases, or gene summaries')
+    parser.add_argument('query', nargs='?', help='FTS5 query, e.g. "resistance AND osimertinib"')
+    parser.add_argument('--genes', action='store_true', help='Search civic_gene instead of civic')
+    parser.add_argument('--limit', type=int, default=LIMIT, help='Number of ids to return')
+    parser.add_argument('--civic-db', default=CIVIC_DB, help='civic annotator database')
+    parser.add_argument('--civic-gene-db', default=CIVIC_GENE_DB, help='civic_gene annotator database')
+    parser.add_argument('--index', action='store_true', help='Add the search tables to both databases in place')
+    parser.add_argument('--top', action='store_true', help='List the highest scoring variants instead of searching')
+    parser.add_argument('--gene', help='With --top, only variants of this gene')
+    parser.add_argument('--disease', help='With --top, only variants with evidence for this disease')
+    parser.add_argument('--min-score', type=float, help='With --top, only scores at or above this')
+    parser.add_argument('--profiles', action='store_true', help='With --top, list molecular profiles from --variants-db')
+    parser.add_argument('--variants-db', default=VARIANTS_DB, help='create_sqlite3.py output')
+    args = parser.parse_args()
+
+    if args.index:
+        for path, table in ((args.civic_db, 'civic'), (args.civic_gene_db, 'civic_gene')):
+            with sqlite3.connect(path) as db:
+                create_search_index(db, table)
+            print(f'Indexed {path}', file=sys.stderr)
+    if args.top:
+        try:
+            if args.profiles:
+                results = top_profiles(args.variants_db, args.min_score, args.limit)
+            else:
+                results = top_variants(args.civic_db, args.gene, args.disease, args.min_score, args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+        for row_id, score in results:
+            print(row_id, score, sep='\t')
+    elif args.query:
+        try:
+            if args.genes:
+                results = search_genes(args.query, args.civic_gene_db, args.limit)
+            else:
+                results = search_variants(args.query, args.civic_db, args.limit)
+        except ValueError as e:
+            parser.error(str(e))
+        for row_id, score in results:
+            print(row_id, f'{score:.3f}', sep='\t')
+    elif not args.index:
+        parser.error('a query, --top or --index is required')
@@ -0,0 +1,74 @@
+import importlib.util
+import json
+import logging
+import os
+import sqlite3
+
+import pytest
+
+from create_sqlite3 import VariantsDB
+
+pytest.importorskip('cravat')
+
+ANNOTATOR_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'civic_molecular_profile')
+
+# Profile 100 is variant 1 AND variant 2; profiles 1 and 3 are single-variant profiles at variant 1's key
+RECORDS = [
+    {'chrom': '7', 'start': 10, 'ref': 'A', 'alt': 'T', 'mp_id': 100, 'variant_ids': [1, 2], 'molecular_profile_score': 5.0,
+     'num_acc_eids': 1, 'num_sub_eids': 0, 'variant_id': 1, 'is_and': True},
+    {'chrom': '7', 'start': 20, 'ref': 'G', 'alt': 'C', 'mp_id': 100, 'variant_ids': [1, 2], 'molecular_profile_score': 5.0,
+     'num_acc_eids': 1, 'num_sub_eids': 0, 'variant_id': 2, 'is_and': True},
+    {'chrom': '7', 'start': 10, 'ref': 'A', 'alt': 'T', 'mp_id': 1, 'variant_ids': [1], 'molecular_profile_score': 3.0,
+     'num_acc_eids': 2, 'num_sub_eids': 1, 'variant_id': 1},
+    {'chrom': '7', 'start': 10, 'ref': 'A', 'alt': 'T', 'mp_id': 3, 'variant_ids': [3], 'molecular_profile_score': 8.0,
+     'num_acc_eids': 4, 'num_sub_eids': 0, 'variant_id': 3},
+]
+
+
+def load_annotator(monkeypatch, tmp_path):
+    monkeypatch.syspath_prepend(ANNOTATOR_DIR)
+    spec = importlib.util.spec_from_file_location('civic_molecular_profile_annotator', os.path.join(ANNOTATOR_DIR, 'civic_molecular_profile.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    path = str(tmp_path / 'civic_molecular_profile.sqlite')
+    with VariantsDB(path) as db:
+        db.insert_records(RECORDS)
+    # The attributes BaseAnnotator sets up for a job, without a job to run
+    annotator = module.CravatAnnotator.__new__(module.CravatAnnotator)
+    annotator.cursor = sqlite3.connect(path).cursor()
+    annotator.logger = logging.getLogger('civic_molecular_profile')
+    annotator.output_dir = str(tmp_path)
+    annotator.output_basename = 'job'
+    annotator.setup()
+    return annotator
+
+
+def variant(uid, chrom, pos, ref, alt):
+    return {'uid': uid, 'chrom': chrom, 'pos': pos, 'ref_base': ref, 'alt_base': alt}
+
+
+def test_single_variant_profiles(monkeypatch, tmp_path):
+    annotator = load_annotator(monkeypatch, tmp_path)
+    out = annotator.annotate(variant(1, 'chr7', 10, 'A', 'T'))
+    assert out['mp_id'] == 3
+    assert out['molecular_profile_score'] == 8.0
+    assert [profile['mp_id'] for profile in json.loads(out['all_profiles'])] == [3, 1]
+    assert annotator.annotate(variant(2, 'chr7', 30, 'A', 'T')) is None
+
+
+def test_and_profile_reported_when_every_component_is_seen(monkeypatch, tmp_path):
+    annotator = load_annotator(monkeypatch, tmp_path)
+    annotator.annotate(variant(1, 'chr7', 10, 'A', 'T'))
+    assert annotator.annotate(variant(2, 'chr7', 20, 'G', 'C')) is None
+    annotator.cleanup()
+    with open(tmp_path / 'job.civic_molecular_profile.compound.tsv') as f:
+        lines = [line.rstrip('\n').split('\t') for line in f]
+    assert lines[1:] == [['100', '1,2', '5.0', '1', '0', '1,2']]
+
+
+def test_and_profile_missing_a_component(monkeypatch, tmp_path):
+    annotator = load_annotator(monkeypatch, tmp_path)
+    annotator.annotate(variant(1, 'chr7', 10, 'A', 'T'))
+    annotator.cleanup()
+    assert not os.path.exists(tmp_path / 'job.civic_molecular_profile.compound.tsv')
@@ -0,0 +1,93 @@
+import io
+import json
+
+import sqlite3
+
+import pytest
+
+from create_sqlite3 import VariantsDB, iter_json_array, iter_records
+
+RECORDS = [{'mp_id': 1, 'chrom': '7'}, {'mp_id': 2, 'chrom': 'X', 'text': 'a, b ] c'}]
+
+
+def test_json_array():
+    assert list(iter_records(io.StringIO(json.dumps(RECORDS)))) == RECORDS
+
+
+def test_json_array_across_chunks():
+    stream = io.StringIO(json.dumps(RECORDS, indent=2)[1:])
+    assert list(iter_json_array(stream, chunk_size=3)) == RECORDS
+
+
+def test_numbers_split_across_chunks():
+    stream = io.StringIO('12345, 678, -9.5e3]')
+    assert list(iter_json_array(stream, chunk_size=2)) == [12345, 678, -9.5e3]
+
+
+def test_empty_array():
+    assert list(iter_records(io.StringIO(' [ ] '))) == []
+
+
+def test_ndjson():
+    text = '\n' + '\n'.join(json.dumps(record) for record in RECORDS) + '\n\n'
+    assert list(iter_records(io.StringIO(text))) == RECORDS
+
+
+def test_empty_input():
+    assert list(iter_records(io.StringIO(''))) == []
+
+
+def test_unterminated_array():
+    with pytest.raises(ValueError):
+        list(iter_records(io.StringIO(json.dumps(RECORDS)[:-1])))
+
+
+def test_truncated_element():
+    with pytest.raises(ValueError):
+        list(iter_records(io.StringIO('[{"mp_id": 1}, {"mp_id"')))
+
+
+def test_missing_separator_fails_without_reading_on():
+    stream = io.StringIO('[{"mp_id": 1} {"mp_id": 2}' + ' ' * 1000 + ']')
+    records = iter_json_array(stream, chunk_size=32)
+    stream.read(1)
+    assert next(records) == {'mp_id': 1}
+    with pytest.raises(ValueError, match='Expected'):
+        next(records)
+    assert stream.tell() < 100
+
+
+def test_malformed_element_fails_at_the_size_bound():
+    stream = io.StringIO('[{"mp_id": nope}, ' + '{"mp_id": 1}, ' * 1000 + ']')
+    stream.read(1)
+    with pytest.raises(ValueError, match='Malformed'):
+        list(iter_json_array(stream, chunk_size=64, max_record_size=256))
+    assert stream.tell() < 1000
+
+
+def test_malformed_ndjson_line():
+    with pytest.raises(ValueError):
+        list(iter_records(io.StringIO('{"mp_id": 1}\n{"mp_id": \n')))
+
+
+def test_profile_evidence(tmp_path):
+    path = str(tmp_path / 'variants.db')
+    evidence = [
+        {'id': 7, 'status': 'accepted', 'level': 'B', 'type': 'PREDICTIVE', 'disease': 'Melanoma', 'therapies': 'Vemurafenib'},
+        {'id': 8, 'status': 'submitted', 'level': 'C', 'type': 'PROGNOSTIC', 'disease': None, 'therapies': None},
+    ]
+    record = {'chrom': '7', 'start': 10, 'ref': 'A', 'alt': 'T', 'mp_id': 12, 'variant_ids': [12], 'variant_id': 12,
+              'molecular_profile_score': 3.0, 'num_acc_eids': 1, 'num_sub_eids': 1,
+              'evidence_levels': {'A': 0, 'B': 1, 'C': 1}, 'evidence_types': {'PREDICTIVE': 1, 'PROGNOSTIC': 1},
+              'evidence_items': evidence}
+    second = dict(record, start=20)
+    del second['evidence_items']
+    with VariantsDB(path) as db:
+        db.insert_records([record, second])
+    with sqlite3.connect(path) as db:
+        assert db.execute('SELECT id, level FROM profile_evidence WHERE mp_id = 12 ORDER BY id').fetchall() == [(7, 'B'), (8, 'C')]
+        assert db.execute('SELECT DISTINCT max_evidence_level, num_predictive_eids FROM variants').fetchall() == [('B', 1)]
+    with VariantsDB(path) as db:
+        db.insert_records([dict(record, evidence_items=evidence[:1])])
+    with sqlite3.connect(path) as db:
+        assert db.execute('SELECT id FROM profile_evidence').fetchall() == [(7,)]
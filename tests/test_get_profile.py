@@ -0,0 +1,42 @@
+import pytest
+
+from get_profile import GraphQLError, fetch_molecular_profile
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+
+class Session:
+    def __init__(self, body):
+        self.body = body
+
+    def post(self, url, json, timeout):
+        return Response(self.body)
+
+
+PROFILE = {'data': {'molecularProfile': {'parsedName': []}}}
+
+
+def test_profile():
+    assert fetch_molecular_profile(12, Session(PROFILE)) == PROFILE
+
+
+@pytest.mark.parametrize('body', [
+    {'errors': [{'message': 'rate limited'}], 'data': None},
+    {'errors': [{'message': 'partial'}], 'data': {'molecularProfile': {'parsedName': []}}},
+    {'data': None},
+    {'data': {'molecularProfile': None}},
+])
+def test_graphql_errors_are_failures(body):
+    with pytest.raises(GraphQLError):
+        fetch_molecular_profile(12, Session(body))
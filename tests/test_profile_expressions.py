@@ -0,0 +1,76 @@
+import pytest
+
+from profile_expressions import PredicateTable, parse, to_dnf
+
+
+def variant(variant_id):
+    return [{'__typename': 'Gene', 'id': 1, 'name': 'GENE'}, {'__typename': 'Variant', 'id': variant_id}]
+
+
+def text(value):
+    return [{'__typename': 'MolecularProfileTextSegment', 'text': value}]
+
+
+def profiles(**parsed_names):
+    return {mp_id[1:]: {'data': {'molecularProfile': {'parsedName': parsed_name}}} for mp_id, parsed_name in parsed_names.items()}
+
+
+def test_single_variant():
+    assert to_dnf(parse(variant(1))) == [({1}, set())]
+
+
+def test_and():
+    assert to_dnf(parse(variant(1) + text('AND') + variant(2))) == [({1, 2}, set())]
+
+
+def test_and_not():
+    assert to_dnf(parse(variant(1) + text('AND NOT') + variant(2))) == [({1}, {2})]
+
+
+def test_or_binds_looser_than_and():
+    tree = parse(variant(1) + text('AND') + variant(2) + text('OR') + variant(3))
+    assert to_dnf(tree) == [({1, 2}, set()), ({3}, set())]
+
+
+def test_parentheses():
+    tree = parse(variant(1) + text('AND (') + variant(2) + text('OR') + variant(3) + text(')'))
+    assert to_dnf(tree) == [({1, 2}, set()), ({1, 3}, set())]
+
+
+def test_negated_parentheses():
+    tree = parse(text('NOT (') + variant(1) + text('OR') + variant(2) + text(')'))
+    assert to_dnf(tree) == [(set(), {1, 2})]
+
+
+def test_contradiction_has_no_clauses():
+    assert to_dnf(parse(variant(1) + text('AND NOT') + variant(1))) == []
+
+
+def test_unknown_token():
+    with pytest.raises(ValueError, match='Unrecognized'):
+        parse(variant(1) + text('XOR') + variant(2))
+
+
+def test_unbalanced_parentheses():
+    with pytest.raises(ValueError):
+        parse(text('(') + variant(1) + text('AND') + variant(2))
+
+
+def test_predicate_table():
+    table = PredicateTable.compile(profiles(
+        m1=variant(1),
+        m2=variant(1) + text('AND') + variant(2),
+        m3=variant(1) + text('AND NOT') + variant(3),
+        m4=variant(1) + text('XOR') + variant(2),
+    ))
+    assert table.errors.keys() == {4}
+    assert table.satisfied([1]) == [1, 3]
+    assert table.satisfied([1, 2]) == [1, 2, 3]
+    assert table.satisfied([1, 3]) == [1]
+    assert table.satisfied([]) == []
+
+
+def test_predicate_table_round_trip(tmp_path):
+    table = PredicateTable.compile(profiles(m1=variant(1) + text('AND') + variant(2)))
+    table.save(tmp_path / 'table.npz')
+    assert PredicateTable.load(tmp_path / 'table.npz').satisfied([1, 2]) == [1]
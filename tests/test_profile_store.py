@@ -0,0 +1,15 @@
+from profile_store import ProfileStore
+
+
+def test_booleans_mapping(tmp_path):
+    profile = {'data': {'molecularProfile': {'parsedName': []}}, 'molecular_profile_id': '12'}
+    with ProfileStore(str(tmp_path / 'profiles.sqlite')) as store:
+        store.put(12, profile)
+        booleans = store.booleans()
+        assert booleans['12'] == profile
+        assert '12' in booleans
+        assert list(booleans) == ['12']
+        assert len(booleans) == 1
+        for key in ('13', 'x', None, 1 << 80):
+            assert key not in booleans
+        assert booleans.get('x') is None
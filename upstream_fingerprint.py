@@ -0,0 +1,51 @@
+"""Fingerprint the current monthly CIViC snapshot, so pipeline.py can tell when the data has changed upstream.
+
+The snapshot files are described with HEAD requests (ETag / Last-Modified, or a
+sha256 of the body when the server sends neither), which is far cheaper than
+loading CIViC through civicpy. The file is only rewritten when a fingerprint
+changes, and left as it is when the snapshot cannot be reached, so the stages
+keyed on it rerun only for new upstream data.
+"""
+import argparse
+import json
+import os
+import sys
+
+import requests
+
+# The fingerprinting is shared with the monthly builders
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'previous-builders'))
+import snapshot_checksum
+
+SNAPSHOT_FILES = ['MolecularProfileSummaries', 'VariantSummaries', 'ClinicalEvidenceSummaries']
+
+
+def fingerprint(session, file_name):
+    remote = snapshot_checksum.get_remote_fingerprint(session, snapshot_checksum.get_current_month_file_url(file_name))
+    # The url names the month, so it is left out to keep an unchanged snapshot's fingerprint unchanged
+    return {key: remote[key] for key in snapshot_checksum.fingerprint_keys}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a fingerprint of the current monthly CIViC snapshot')
+    parser.add_argument('--out', default='upstream_manifest.json', help='Fingerprint file')
+    args = parser.parse_args()
+
+    try:
+        with requests.Session() as s:
+            manifest = {file_name: fingerprint(s, file_name) for file_name in SNAPSHOT_FILES}
+    except requests.RequestException as e:
+        print(f'CIViC snapshot not available, keeping {args.out}: {e}', file=sys.stderr)
+        sys.exit(0)
+
+    try:
+        with open(args.out) as f:
+            unchanged = json.load(f) == manifest
+    except (IOError, ValueError):
+        unchanged = False
+    if unchanged:
+        print('CIViC snapshot unchanged', file=sys.stderr)
+    else:
+        with open(args.out + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(args.out + '.tmp', args.out)